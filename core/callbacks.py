@@ -5,7 +5,7 @@ import datetime
 import logging
 import socket
 import subprocess
-import multiprocessing.pool
+from functools import partial
 from urllib import urlopen
 
 from oid_translate import ObjectId
@@ -13,12 +13,18 @@ from pyasn1.codec.ber import decoder
 from pyasn1.type.error import ValueConstraintError
 from pysnmp.proto import api
 from pysnmp.proto.error import ProtocolError
+from tornado import gen
+from tornado.process import Subprocess
 
 from core.dde import DdeNotification
 from core.constants import SNMP_VERSIONS
 from core.message import Notification, Metrics
 from core.utils import parse_time_string
 from core.models import Target, FPingMessage, Device, Port
+from core.schema import rtt_fields
+from core.spool import device_record
+from core.profiling import timer
+from core.rtt import RttBuffer, exceeded
 
 try:
     from dde_plugin import run as dde_run
@@ -27,11 +33,17 @@ except ImportError as err:
         pass
 
 class TrapperCallback(object):
-    def __init__(self, db_engine, config, community):
+    def __init__(self, db_engine, config, community, trap_filter=None):
         self.db_engine = db_engine
         self.config = config
         self.hostname = socket.gethostname()
         self.community = community
+        self.trap_filter = trap_filter
+
+    def accept(self, host, whole_msg):
+        if self.trap_filter is None:
+            return True
+        return self.trap_filter.check(host, whole_msg) is None
 
     def __call__(self, *args, **kwargs):
         try:
@@ -57,7 +69,8 @@ class TrapperCallback(object):
         version = SNMP_VERSIONS[msg_version]
 
         try:
-            req_msg, whole_msg = decoder.decode(whole_msg, asn1Spec=proto_module.Message(),)
+            with timer("trap.decode"):
+                req_msg, whole_msg = decoder.decode(whole_msg, asn1Spec=proto_module.Message(),)
         except (ProtocolError, ValueConstraintError) as err:
             return
         req_pdu = proto_module.apiMessage.getPDU(req_msg)
@@ -111,38 +124,83 @@ class FPingTarget(object):
         self.idx = idx
         self.state = state
 
-def generate_fping_metrics(target, count):
-    host = target.host
-    metrics = []
-        
-    try:
-        subp = subprocess.Popen(COMMAND,
-                                shell=True,
-                                stdout=subprocess.PIPE)
-        output = subp.communicate()[0]
-    except Exception:
-        logging.error("unexpected error while execute cmd : %s" % COMMAND)
-        return None
-
-    data = output.split()
-    if len(data) == 7:
-        host_str, xmt, rcv, loss_rate, _min, _avg, _max = data
-    elif len(data) == 4:
-        host_str, xmt, rcv, loss_rate = data
-        _min = _avg = _max = 0
-    else:
-        _avg = 0
-        loss_rate = '100%'
-        #return None
+def parse_fping_rtts(output, count):
+    # fping -C -q prints "host : 0.41 0.38 - 0.40" with "-" for lost pings.
+    _, sep, values = output.strip().partition(" : ")
+    rtts = []
+    for value in values.split()[:count] if sep else []:
+        try:
+            rtts.append(float(value))
+        except ValueError:
+            rtts.append(None)
+    rtts.extend([None] * (count - len(rtts)))
+    return rtts
+
+def fping_metrics(target, output, count):
+    rtts = parse_fping_rtts(output, count)
+    received = [rtt for rtt in rtts if rtt is not None]
+    _avg = sum(received) / len(received) if received else 0.0
+    loss_rate = 100.0 * (count - len(received)) / count
 
     state = 1 if _avg > 0 else 0
     metrics = Metrics(target.idx, target.host, target.state, state,
-                      float(_avg), float(loss_rate.replace('%', '')))
-    return metrics
+                      float(_avg), float(loss_rate))
+    return metrics, rtts
+
+@gen.coroutine
+def run_fping(target, count):
+    command = ["fping", "-C", str(count), "-q", target.host]
+    try:
+        subp = Subprocess(command,
+                          stdout=Subprocess.STREAM,
+                          stderr=subprocess.STDOUT)
+        output = yield subp.stdout.read_until_close()
+        yield subp.wait_for_exit(raise_error=False)
+    except Exception:
+        logging.error("unexpected error while execute cmd : %s" % " ".join(command))
+        raise gen.Return(None)
+
+    raise gen.Return(fping_metrics(target, output, count))
+
+@gen.coroutine
+def probe_targets(targets, count, concurrency):
+    """Probes every target with at most ``concurrency`` fping processes running."""
+    results = [None] * len(targets)
+    pending = iter(enumerate(targets))
+
+    @gen.coroutine
+    def worker():
+        for idx, target in pending:
+            results[idx] = yield run_fping(target, count)
+
+    yield [worker() for _ in range(min(concurrency, len(targets)))]
+    raise gen.Return(results)
+
+def update_device_metrics(db_engine, idx, host, old_state, state, avg, loss_rate, last_time, rtt=None):
+    fields = dict(state=state, avg=avg, loss_rate=loss_rate, last_time=last_time)
+    fields.update(rtt_fields(db_engine, rtt))
+    query = Device.update(**fields).where(Device.id == idx)
+    query.execute(db_engine)
+
+    query = Port.update(state=state).where(Port.device_id == idx)
+    query.execute(db_engine)
+
+    query = Target.update(state=state).where(Target.device_id == idx)
+    query.execute(db_engine)
+    if old_state <> state:
+        info = 'linkUp' if state == 1 else 'linkDown'
+        FPingMessage.insert(host=host, info=info).execute(db_engine)
 
 class FPingCallback(object):
-    def __init__(self, db_engine):
+    def __init__(self, db_engine, runtime, coordinator=None, spool=None):
         self.db_engine = db_engine
+        self.runtime = runtime
+        # Loads and writes run on their own ordered queue, off the shared
+        # executor that syslog and trap bursts fill.
+        self.writer = runtime.serial("sweep")
+        self.coordinator = coordinator
+        self.spool = spool
+        self.rtt_summary = {}
 
     @staticmethod
     def connected(host="http://www.test.com"):
@@ -152,61 +210,111 @@ class FPingCallback(object):
         except:
             return False
     
+    @gen.coroutine
     def __call__(self, *args, **kwargs):
         try:
-            self._call(*args, **kwargs)
+            yield self._call(*args, **kwargs)
         except Exception as err:
             logging.exception("FPingCallback Failed: %s", str(err))
 
     def _send_mail(self, handler, fping, is_duplicate):
         pass
 
-    def _call(self, process_count, fping_count):
-        result = []
-        targets = []
+    def rtt_stats(self):
+        return self.rtt_summary
 
-        if self.connected() == False:
+    @gen.coroutine
+    def _call(self, process_count, fping_count, rtt_thresholds=None):
+        connected = yield self.writer.submit(self.connected)
+        if connected == False:
             logging.error("NOTE!!! HealthCheck is not connected")
             return
-        
+
+        targets = yield self.writer.submit(self._load_targets)
+        if targets is None:
+            return
+
+        with timer("sweep.probe"):
+            result = yield probe_targets(targets, fping_count, process_count)
+
+        yield self.writer.submit(self._write_results, result,
+                                 fping_count, rtt_thresholds)
+
+    def _load_targets(self):
+        targets = []
         try:
-            with self.db_engine:
+            with timer("sweep.load"), self.db_engine:
                 #for target in Target.select():
-                for target in Device.select().where(Device.host.is_null(False), Device.device_type != 3, Device.enable == 1):
+                query = Device.select(Device.id, Device.host, Device.state).where(
+                    Device.host.is_null(False), Device.device_type != 3, Device.enable == 1)
+                for target in query.execute(self.db_engine):
                     targets.append(FPingTarget(target.host, target.id, target.state))
         except Exception as err:
             logging.error("FPingCallback get targets: %s", str(err))
-            return
-
+            return None
+
+        if self.coordinator is not None:
+            try:
+                ring = self.coordinator.ring()
+                targets = [t for t in targets if self.coordinator.owns(t.idx, ring)]
+            except Exception as err:
+                logging.error("FPingCallback get shard: %s", str(err))
+                return None
+            logging.info("FPingCallback shard %s owns %d targets",
+                         self.coordinator.node_id, len(targets))
+        return targets
+
+    def _write_results(self, result, fping_count, rtt_thresholds):
+        metrics = []
+        rtt_buffer = RttBuffer(fping_count)
+        with timer("sweep.parse"):
+            for r in result:
+                if r is not None:
+                    m, rtts = r
+                    rtt_buffer.append(rtts)
+                    metrics.append((m, datetime.datetime.now()))
+
+        with timer("sweep.rtt"):
+            host_stats, sweep_stats = rtt_buffer.summarize()
+        self.rtt_summary = dict(sweep_stats, hosts=len(rtt_buffer))
+        logging.info("FPingCallback sweep rtt: %s", self.rtt_summary)
+
+        # A host that answers but goes over a threshold is reported down.
+        metrics = [(m, last_time, self._state(m, rtt, rtt_thresholds), rtt)
+                   for (m, last_time), rtt in zip(metrics, host_stats)]
+
+        # Updates queue behind anything already spooled, and a failed write
+        # is spooled before any other writer may go to the database, so
+        # replay never overwrites a newer state with an older one.
         try:
-            multi_process_pool = multiprocessing.Pool(process_count)
-            for t in targets:
-                result.append(multi_process_pool.apply_async(generate_fping_metrics, (t, fping_count)))
-        except Exception as err:
-            logging.error("FPingCallback multiprocessing pool: %s", str(err))
-        finally:
-            multi_process_pool.close()
-            multi_process_pool.join()
-    
-        # multi_process_pool.close()
-        # multi_process_pool.join()
-
-        try:
-            with self.db_engine:
-                for res in result:
-                    m = res.get()
-                    last_time = datetime.datetime.now()
-                    query = Device.update(state=m.state, avg=m.avg,
-                                          loss_rate=m.loss_rate, last_time=last_time).where(Device.id == m.idx)
-                    query.execute()
-                    
-                    query = Port.update(state=m.state).where(Port.device_id == m.idx)
-                    query.execute()
-
-                    query = Target.update(state=m.state).where(Target.device_id == m.idx)
-                    query.execute()
-                    if m.old_state <> m.state:
-                        info = 'linkUp' if m.state == 1 else 'linkDown'
-                        FPingMessage.create(host=m.host, info=info)
+            if self.spool is None:
+                self._write_metrics(metrics)
+            elif not self.spool.write_through(partial(self._write_metrics, metrics),
+                                              self._metric_records(metrics)):
+                logging.warning("FPingCallback spooled %d updates behind pending ones",
+                                len(metrics))
         except Exception as err:
             logging.error("FPingCallback update state: %s", str(err))
+            if self.spool is not None:
+                logging.warning("FPingCallback spooled %d updates", len(metrics))
+
+    def _write_metrics(self, metrics):
+        with timer("sweep.db_write"), self.db_engine:
+            for m, last_time, state, rtt in metrics:
+                update_device_metrics(self.db_engine, m.idx, m.host, m.old_state, state,
+                                      m.avg, m.loss_rate, last_time, rtt)
+
+    @staticmethod
+    def _state(m, rtt, rtt_thresholds):
+        if m.state and rtt_thresholds:
+            over = exceeded(rtt_thresholds, dict(rtt, loss_rate=m.loss_rate))
+            if over:
+                logging.info("FPingCallback %s over thresholds: %s", m.host, ", ".join(over))
+                return 0
+        return m.state
+
+    @staticmethod
+    def _metric_records(metrics):
+        return [device_record(m.idx, m.host, m.old_state, state,
+                              m.avg, m.loss_rate, last_time, rtt)
+                for m, last_time, state, rtt in metrics]
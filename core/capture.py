@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import struct
+import threading
+import time
+
+MAGIC = "HCCAP1\n"
+RECORD = struct.Struct("<dBI")
+
+SYSLOG = 0
+TRAP = 1
+KINDS = {SYSLOG: "syslog", TRAP: "trap"}
+
+MAX_DURATION = 3600
+
+
+class CaptureWriter(object):
+    """Writes ``<timestamp><kind><length><payload>`` records after a magic."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+
+    def write(self, kind, data, timestamp=None):
+        with self._lock:
+            self._file.write(RECORD.pack(timestamp or time.time(), kind, len(data)))
+            self._file.write(data)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """Yields (timestamp, kind, payload) from a capture file."""
+    with open(path, "rb") as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+        while True:
+            header = capture.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timestamp, kind, length = RECORD.unpack(header)
+            data = capture.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, kind, data
+
+
+class Capture(object):
+    """Records what the live listeners receive for a bounded window.
+
+    The syslog and trap services call ``record`` for every raw payload;
+    it is a no-op unless ``start`` opened a capture file.
+    """
+
+    def __init__(self, output_dir, ioloop):
+        self.output_dir = output_dir
+        self.ioloop = ioloop
+        self._writer = None
+
+    def active(self):
+        return self._writer is not None
+
+    def start(self, duration=60):
+        duration = max(1, min(int(duration), MAX_DURATION))
+        if self.active():
+            logging.warning("Capture already running")
+            return None
+        path = os.path.join(self.output_dir, time.strftime("capture-%Y%m%d-%H%M%S.hccap"))
+        self._writer = CaptureWriter(path)
+        self.ioloop.call_later(duration, self.stop)
+        logging.info("Capture started for %ds, writing %s", duration, path)
+        return path
+
+    def stop(self):
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+            logging.info("Capture wrote %d records to %s", writer.count, writer.path)
+
+    def record(self, kind, data):
+        writer = self._writer
+        if writer is not None:
+            writer.write(kind, data)
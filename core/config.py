@@ -4,6 +4,7 @@
 import collections
 import copy
 import logging
+import multiprocessing
 from oid_translate import ObjectId
 import yaml
 
@@ -39,6 +40,50 @@ class Config(object):
                 self.get('db_user'),
                 self.get('db_passwd'))
 
+    def get_scheduler_config(self):
+        process_count = self.get('process_count')
+        if not process_count:
+            cpu_count = multiprocessing.cpu_count() * 2 + 1
+            process_count = cpu_count if cpu_count < 11 else 10
+        fping_count = int(self.get('fping_count') or 0)
+        if not fping_count:
+            fping_count = 5
+        interval_time = int(self.get('interval_time') or 0)
+        if not interval_time:
+            interval_time = 1
+        return (process_count, fping_count, interval_time)
+
+    def get_rtt_thresholds(self):
+        return self.get('rtt_thresholds') or {}
+
+    def diff(self, other):
+        keys = set(self._config) | set(other._config)
+        return set(key for key in keys if self.get(key) != other.get(key))
+
+    def merge(self, other, keys):
+        """Returns a copy with ``keys`` taken from ``other``."""
+        config = dict(self._config)
+        for key in keys:
+            if key in other:
+                config[key] = other[key]
+            else:
+                config.pop(key, None)
+        return Config(config, self.handlers)
+
+    def get_spool_config(self):
+        spool = self.get('spool') or {}
+        return (spool.get('path'),
+                spool.get('max_size', 64 * 1024 * 1024),
+                spool.get('fsync', 'always'),
+                spool.get('replay_interval', 10))
+
+    def get_shard_config(self):
+        shard = self.get('shard') or {}
+        return (shard.get('enabled', False),
+                shard.get('node_id'),
+                shard.get('lease_time', 30),
+                shard.get('vnodes', 64))
+
     @staticmethod
     def from_file(config_filename, handlers=True):
         with open(config_filename) as config_file:
@@ -61,6 +106,14 @@ class Handlers(object):
             index = "." + index
         return self._traphandlers.get(index, self._defaults)
 
+    def __eq__(self, other):
+        return (isinstance(other, Handlers) and
+                self._defaults == other._defaults and
+                self._traphandlers == other._traphandlers)
+
+    def __ne__(self, other):
+        return not self == other
+
     @staticmethod
     def update(original, update_from):
         for key, value in update_from.iteritems():
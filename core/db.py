@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from playhouse.pool import PooledMySQLDatabase
+
+POOL_NAMES = ("sweep", "syslog", "traps")
+
+POOL_DEFAULTS = {
+    "sweep": {"max_connections": 10, "stale_timeout": 300, "wait_timeout": 10,
+              "query_timeout": 30},
+    "syslog": {"max_connections": 10, "stale_timeout": 300, "wait_timeout": 5,
+               "query_timeout": 10},
+    "traps": {"max_connections": 4, "stale_timeout": 300, "wait_timeout": 5,
+              "query_timeout": 10},
+}
+
+
+class StatsPooledMySQLDatabase(PooledMySQLDatabase):
+    """PooledMySQLDatabase that counts checkouts and time spent waiting."""
+
+    def __init__(self, database, name=None, **kwargs):
+        self.pool_name = name
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._errors = 0
+        super(StatsPooledMySQLDatabase, self).__init__(database, **kwargs)
+
+    def connect(self, reuse_if_open=False):
+        if reuse_if_open and not self.is_closed():
+            return False
+
+        full = self._max_connections and len(self._in_use) >= self._max_connections
+        start = time.time()
+        try:
+            result = super(StatsPooledMySQLDatabase, self).connect(reuse_if_open)
+        except Exception:
+            with self._stats_lock:
+                self._errors += 1
+            raise
+        elapsed = time.time() - start
+
+        with self._stats_lock:
+            self._checkouts += 1
+            if full:
+                self._waits += 1
+                self._wait_time += elapsed
+        return result
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_connections": self._max_connections,
+                "in_use": len(self._in_use),
+                "idle": len(self._connections),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time": round(self._wait_time, 3),
+                "errors": self._errors,
+            }
+
+
+class DatabasePools(object):
+    """One bounded connection pool per subsystem.
+
+    Pool sizes come from the optional ``db_pools`` config section, e.g.::
+
+        db_pools:
+          sweep: {max_connections: 10, stale_timeout: 300, wait_timeout: 10,
+                  query_timeout: 30}
+
+    ``query_timeout`` bounds every read and write on a connection, so a
+    server that accepts connections but stalls on statements raises instead
+    of blocking the worker, and the update is spooled. 0 disables it.
+
+    Models are bound to the sweep pool; the other subsystems pass their pool
+    to ``query.execute(db)`` explicitly.
+    """
+
+    def __init__(self, config):
+        db_host, db_port, db_name, db_user, db_passwd = config.get_database_config()
+        pool_config = config.get("db_pools") or {}
+
+        self._pools = {}
+        for name in POOL_NAMES:
+            settings = dict(POOL_DEFAULTS[name])
+            settings.update(pool_config.get(name) or {})
+            timeouts = {}
+            if settings["query_timeout"]:
+                timeouts = dict(read_timeout=settings["query_timeout"],
+                                write_timeout=settings["query_timeout"])
+            self._pools[name] = StatsPooledMySQLDatabase(
+                db_name, name=name, host=db_host, port=db_port,
+                user=db_user, password=db_passwd,
+                max_connections=settings["max_connections"],
+                stale_timeout=settings["stale_timeout"],
+                timeout=settings["wait_timeout"], **timeouts)
+            logging.info("DatabasePools %s: %s", name, settings)
+
+    def __getitem__(self, name):
+        return self._pools[name]
+
+    def bind(self, models):
+        self._pools["sweep"].bind(models)
+
+    def stats(self):
+        return dict((name, pool.stats()) for name, pool in self._pools.items())
+
+    def close_all(self):
+        for pool in self._pools.values():
+            try:
+                pool.close_all()
+            except Exception as err:
+                logging.error("DatabasePools close %s: %s", pool.pool_name, str(err))
@@ -6,3 +6,6 @@ class Error(Exception):
 
 class ConfigError(Error):
     pass
+
+class SpoolError(Error):
+    pass
@@ -28,6 +28,10 @@ class Device(BaseModel):
     enable = SmallIntegerField(default=1)
     avg       = FloatField()
     loss_rate = FloatField()
+    rtt_min   = FloatField(null=True)
+    rtt_max   = FloatField(null=True)
+    rtt_p95   = FloatField(null=True)
+    jitter    = FloatField(null=True)
     last_time = DateTimeField()
 
     class Meta:
@@ -53,3 +57,13 @@ class EventMessage(BaseModel):
 
     class Meta:
         table_name = 'SystemEvents'
+
+class Member(BaseModel):
+    node_id = CharField(primary_key=True)
+    joined_time = DateTimeField()
+    heartbeat_time = DateTimeField()
+    lease_expires = DateTimeField()
+    left_time = DateTimeField(null=True)
+
+    class Meta:
+        table_name = 'healthchecker_member'
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import contextlib
+import cProfile
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+MAX_DURATION = 300
+SAMPLE_INTERVAL = 0.01
+
+
+class Timers(object):
+    """Always-on, per-stage wall clock timers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    def record(self, name, elapsed):
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = [0, 0.0, 0.0, 0.0]
+            stage[0] += 1
+            stage[1] += elapsed
+            stage[2] = max(stage[2], elapsed)
+            stage[3] = elapsed
+
+    def stats(self):
+        with self._lock:
+            return dict((name, {"count": count, "total": round(total, 6),
+                                "max": round(_max, 6), "last": round(last, 6)})
+                        for name, (count, total, _max, last) in self._stages.items())
+
+
+timers = Timers()
+timer = timers.timer
+
+
+class Profiler(object):
+    """Captures a bounded profile of the running daemon on demand.
+
+    ``start`` samples the stacks of all threads for ``duration`` seconds
+    and runs cProfile on the runtime loop thread for the same window.
+    Results are written to ``output_dir`` as a folded stack file and a
+    pstats file.
+    """
+
+    def __init__(self, output_dir, ioloop):
+        self.output_dir = output_dir
+        self.ioloop = ioloop
+        self._lock = threading.Lock()
+        self._until = 0
+        self._prefix = None
+
+    def active(self):
+        return time.time() < self._until
+
+    def start(self, duration=30):
+        duration = max(1, min(int(duration), MAX_DURATION))
+        with self._lock:
+            if self.active():
+                logging.warning("Profiler already running")
+                return None
+            self._until = time.time() + duration
+            self._prefix = os.path.join(self.output_dir,
+                                        time.strftime("profile-%Y%m%d-%H%M%S"))
+        thread = threading.Thread(target=self._sample, args=(duration, self._prefix),
+                                  name="Profiler")
+        thread.daemon = True
+        thread.start()
+        self.ioloop.add_callback(self._profile_loop, duration, self._prefix)
+        logging.info("Profiler started for %ds, writing %s.*", duration, self._prefix)
+        return self._prefix
+
+    def install(self):
+        signal.signal(signal.SIGUSR1, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self.ioloop.add_callback_from_signal(self.start)
+
+    def _profile_loop(self, duration, prefix):
+        profile = cProfile.Profile()
+        profile.enable()
+        self.ioloop.call_later(duration, self._finish_loop, profile, prefix)
+
+    def _finish_loop(self, profile, prefix):
+        profile.disable()
+        filename = prefix + ".loop.pstats"
+        try:
+            profile.dump_stats(filename)
+            logging.info("Profiler wrote %s", filename)
+        except Exception as err:
+            logging.error("Profiler write %s: %s", filename, str(err))
+
+    def _sample(self, duration, prefix):
+        stacks = collections.Counter()
+        me = threading.current_thread().ident
+        end = time.time() + duration
+        samples = 0
+
+        while time.time() < end:
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name,
+                                                 os.path.basename(code.co_filename),
+                                                 frame.f_lineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(SAMPLE_INTERVAL)
+
+        try:
+            with open(prefix + ".folded", "w") as output:
+                for stack, count in stacks.most_common():
+                    output.write("%s %d\n" % (stack, count))
+        except Exception as err:
+            logging.error("Profiler write samples: %s", str(err))
+        logging.info("Profiler wrote %d samples to %s.folded", samples, prefix)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import signal
+import threading
+
+from core.config import Config
+from core.trapfilter import TrapFilter
+
+RESTART_KEYS = set(["db_host", "db_name", "db_user", "db_passwd", "db_port",
+                    "trap_port", "stats_port", "stats_host", "ipv6", "shard",
+                    "db_pools", "spool", "profile_dir",
+                    "workers", "capture_dir", "trap_max_inflight",
+                    "syslog_max_pending"])
+TRAP_KEYS = set(["community", "trap_filter"])
+SCHEDULER_KEYS = set(["process_count", "fping_count", "interval_time", "rtt_thresholds"])
+
+
+class ConfigReloader(object):
+    """Re-reads the config file on SIGHUP and swaps the changed parts in.
+
+    Parsing runs on the runtime executor so the loop is never paused.
+    New values are published by plain attribute assignment, so the trap
+    callback sees either the old or the new handler table, never a mix.
+    """
+
+    def __init__(self, config_filename, config, trap_cb, runtime, coordinator=None):
+        self.config_filename = config_filename
+        self.config = config
+        self.trap_cb = trap_cb
+        self.runtime = runtime
+        self.coordinator = coordinator
+        self._lock = threading.Lock()
+
+    def install(self):
+        signal.signal(signal.SIGHUP, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self.runtime.ioloop.add_callback_from_signal(self.runtime.run_in_executor, self.reload)
+
+    def reload(self):
+        if not self._lock.acquire(False):
+            logging.warning("ConfigReloader: reload already in progress")
+            return
+        try:
+            self._reload()
+        except Exception as err:
+            logging.exception("ConfigReloader Failed: %s", err)
+        finally:
+            self._lock.release()
+
+    def _reload(self):
+        logging.info("ConfigReloader: reloading %s", self.config_filename)
+        try:
+            config = Config.from_file(self.config_filename)
+        except Exception as err:
+            logging.error("ConfigReloader: keeping running config, %s", str(err))
+            return
+
+        changed = self.config.diff(config)
+        handlers_changed = self.config.handlers != config.handlers
+        if not changed and not handlers_changed:
+            logging.info("ConfigReloader: nothing changed")
+            return
+
+        restart = changed & RESTART_KEYS
+        for key in sorted(restart):
+            logging.warning("ConfigReloader: %s changed, restart required to apply", key)
+        # Restart-only keys keep their running values, so every later reload
+        # keeps warning until the process is restarted.
+        config = config.merge(self.config, restart)
+
+        if handlers_changed or changed & TRAP_KEYS:
+            self._reload_traps(config)
+        if changed & SCHEDULER_KEYS:
+            self._reload_scheduler(config)
+
+        self.config = config
+        applied = sorted(changed - restart) + (["traphandlers"] if handlers_changed else [])
+        if applied:
+            logging.info("ConfigReloader: applied %s", ", ".join(applied))
+
+    def _reload_traps(self, config):
+        community = config.get("community") or None
+        counters = self.trap_cb.trap_filter.counters if self.trap_cb.trap_filter else None
+        trap_filter = TrapFilter.from_config(config, community, counters)
+        self.trap_cb.trap_filter = trap_filter
+        self.trap_cb.community = community
+        self.trap_cb.config = config
+
+    def _reload_scheduler(self, config):
+        process_count, fping_count, interval_time = config.get_scheduler_config()
+        _, _, old_interval_time = self.config.get_scheduler_config()
+
+        rtt_thresholds = config.get_rtt_thresholds()
+
+        self.runtime.modify("sweep", process_count, fping_count, rtt_thresholds)
+        if interval_time != old_interval_time:
+            self.runtime.reschedule("sweep", interval_time * 60)
+            if self.coordinator is not None:
+                self.coordinator.interval = interval_time * 60
+        logging.info("ConfigReloader: process count %s, fping count %d, interval %d, rtt thresholds %s",
+                     process_count, fping_count, interval_time, rtt_thresholds)
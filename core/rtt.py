@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import array
+import math
+import warnings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float("nan")
+
+STATS = ("rtt_min", "rtt_avg", "rtt_max", "rtt_p95", "jitter")
+
+
+class RttBuffer(object):
+    """Per-ping RTTs of a whole sweep in one flat array of doubles.
+
+    Every host gets a row of ``count`` samples, lost pings are NaN, so the
+    buffer can be viewed as a hosts x count matrix without copying.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.rows = 0
+        self._data = array.array("d")
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, rtts):
+        rtts = list(rtts[:self.count])
+        rtts.extend([None] * (self.count - len(rtts)))
+        self._data.extend(NAN if rtt is None else rtt for rtt in rtts)
+        self.rows += 1
+        return self.rows - 1
+
+    def summarize(self):
+        """Returns (per host stats, whole sweep stats) as dicts keyed by STATS."""
+        if not self.rows:
+            return [], dict((name, None) for name in STATS)
+        if numpy is not None:
+            return self._summarize_numpy()
+        return self._summarize_python()
+
+    def _summarize_numpy(self):
+        data = numpy.frombuffer(self._data, dtype=numpy.float64).reshape(self.rows, self.count)
+        with warnings.catch_warnings():
+            # Rows where every ping was lost reduce to NaN.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            diff = numpy.abs(numpy.diff(data, axis=1))
+            columns = (numpy.nanmin(data, axis=1),
+                       numpy.nanmean(data, axis=1),
+                       numpy.nanmax(data, axis=1),
+                       numpy.nanpercentile(data, 95, axis=1),
+                       numpy.nanmean(diff, axis=1) if self.count > 1 else
+                       numpy.full(self.rows, NAN))
+            sweep = (numpy.nanmin(data), numpy.nanmean(data), numpy.nanmax(data),
+                     numpy.nanpercentile(data, 95),
+                     numpy.nanmean(diff) if self.count > 1 else NAN)
+
+        hosts = [dict(zip(STATS, (_value(v) for v in row)))
+                 for row in zip(*[column.tolist() for column in columns])]
+        return hosts, dict(zip(STATS, (_value(v) for v in sweep)))
+
+    def _summarize_python(self):
+        hosts = []
+        values = []
+        diffs = []
+        for row in range(self.rows):
+            samples = self._data[row * self.count:(row + 1) * self.count]
+            received = [rtt for rtt in samples if not math.isnan(rtt)]
+            row_diffs = [abs(b - a) for a, b in zip(samples, samples[1:])
+                         if not (math.isnan(a) or math.isnan(b))]
+            hosts.append(_stats(received, row_diffs))
+            values.extend(received)
+            diffs.extend(row_diffs)
+        return hosts, _stats(values, diffs)
+
+
+def _value(value):
+    return None if math.isnan(value) else float(value)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    k = (len(values) - 1) * percent / 100.0
+    f = int(math.floor(k))
+    c = int(math.ceil(k))
+    if f == c:
+        return values[f]
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+def _stats(values, diffs):
+    if not values:
+        return dict((name, None) for name in STATS)
+    return {
+        "rtt_min": min(values),
+        "rtt_avg": sum(values) / len(values),
+        "rtt_max": max(values),
+        "rtt_p95": _percentile(values, 95),
+        "jitter": sum(diffs) / len(diffs) if diffs else None,
+    }
+
+
+def exceeded(thresholds, stats):
+    """Names of the thresholds that ``stats`` goes over."""
+    return [name for name, limit in sorted(thresholds.items())
+            if stats.get(name) is not None and stats[name] > limit]
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import signal
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.process import Subprocess
+
+
+class IntervalJob(object):
+    """Runs ``func`` every ``seconds`` on the runtime loop.
+
+    Coroutine jobs run on the loop itself, blocking jobs on a serial executor
+    of their own, so they never queue behind other work. A run is skipped while the previous one is still going.
+    With ``delay``, a callable returning the seconds until the next run, the
+    job is re-armed after every run instead of ticking from its start time.
+    """
+
+    def __init__(self, runtime, name, seconds, func, args=(), blocking=False, delay=None):
+        self.runtime = runtime
+        self.name = name
+        self.seconds = seconds
+        self.func = func
+        self.args = tuple(args)
+        self.blocking = blocking
+        self.delay = delay
+        self._periodic = None
+        self._timeout = None
+        self.future = None
+
+    def start(self):
+        if self.delay is not None:
+            self._arm()
+            return
+        self._periodic = PeriodicCallback(self._run, self.seconds * 1000)
+        self._periodic.start()
+
+    def stop(self):
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
+        if self._timeout is not None:
+            self.runtime.ioloop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _arm(self):
+        self._timeout = self.runtime.ioloop.call_later(max(0, self.delay()), self._fire)
+
+    def _fire(self):
+        self._run()
+        self._arm()
+
+    def modify(self, args):
+        self.args = tuple(args)
+
+    def reschedule(self, seconds):
+        self.seconds = seconds
+        if self._periodic is not None or self._timeout is not None:
+            self.stop()
+            self.start()
+
+    def _run(self):
+        if self.future is not None:
+            logging.warning("Runtime: %s still running, skipped", self.name)
+            return
+        try:
+            if self.blocking:
+                future = self.runtime.serial(self.name).submit(self.func, *self.args)
+            else:
+                future = self.func(*self.args)
+        except Exception:
+            logging.exception("Runtime: %s failed to start", self.name)
+            return
+        self.future = future
+        self.runtime.ioloop.add_future(future, self._done)
+
+    def _done(self, future):
+        self.future = None
+        if future.exception() is not None:
+            logging.error("Runtime: %s failed: %s", self.name, future.exception())
+
+
+class SerialExecutor(object):
+    """Runs submitted calls one at a time, in the order they were submitted.
+
+    At most ``max_pending`` calls are queued or running; ``submit`` returns
+    None instead of queueing past that.
+    """
+
+    def __init__(self, name, max_pending=None):
+        self.name = name
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(1)
+
+    def submit(self, func, *args, **kwargs):
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                self.dropped += 1
+                return None
+            self._pending += 1
+        future = self._executor.submit(func, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._pending, "dropped": self.dropped,
+                    "max_pending": self.max_pending}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait)
+
+
+class Runtime(object):
+    """One IOLoop for every subsystem plus one bounded executor.
+
+    The loop hosts the interval jobs, the syslog and trap sockets and the
+    probe subprocesses; blocking work goes to ``executor``. Work that must
+    stay in order, such as state writes, goes to a named ``serial``
+    executor instead. ``stop`` runs the registered stop callbacks in order,
+    gives running jobs up to ``stop_timeout`` seconds to finish and ends the
+    loop, ``shutdown`` then drains the executor and the serial queues.
+    """
+
+    def __init__(self, max_workers=10, stop_timeout=30):
+        self.ioloop = IOLoop.current()
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.max_workers = max_workers
+        self.stop_timeout = stop_timeout
+        self._jobs = {}
+        self._serial = {}
+        self._serial_lock = threading.Lock()
+        self._stop_callbacks = []
+        self._stopping = False
+
+    def run_in_executor(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def serial(self, name, max_pending=None):
+        """Returns the serial executor called ``name``, creating it once."""
+        with self._serial_lock:
+            executor = self._serial.get(name)
+            if executor is None:
+                executor = self._serial[name] = SerialExecutor(name, max_pending)
+            return executor
+
+    def stats(self):
+        with self._serial_lock:
+            serial = dict(self._serial)
+        return dict((name, executor.stats()) for name, executor in serial.items())
+
+    def add_interval(self, name, seconds, func, args=(), blocking=False, delay=None):
+        job = IntervalJob(self, name, seconds, func, args, blocking, delay)
+        self._jobs[name] = job
+        return job
+
+    # modify and reschedule may be called from any thread, e.g. the reloader.
+    def modify(self, name, *args):
+        self.ioloop.add_callback(self._jobs[name].modify, args)
+
+    def reschedule(self, name, seconds):
+        self.ioloop.add_callback(self._jobs[name].reschedule, seconds)
+
+    def add_stop_callback(self, callback):
+        self._stop_callbacks.append(callback)
+
+    def install(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self.ioloop.add_callback_from_signal(self.stop)
+
+    def start(self):
+        logging.info("Runtime start with %d workers", self.max_workers)
+        # Reaps probe subprocesses from the loop.
+        Subprocess.initialize()
+        for job in self._jobs.values():
+            job.start()
+        self.ioloop.start()
+
+    @gen.coroutine
+    def stop(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        logging.info("Runtime stop...")
+        for job in self._jobs.values():
+            job.stop()
+        for callback in self._stop_callbacks:
+            try:
+                callback()
+            except Exception as err:
+                logging.exception("Runtime stop callback failed: %s", err)
+
+        deadline = self.ioloop.time() + self.stop_timeout
+        for job in self._jobs.values():
+            if job.future is None:
+                continue
+            logging.info("Runtime: waiting for %s", job.name)
+            try:
+                yield gen.with_timeout(deadline, job.future)
+            except gen.TimeoutError:
+                logging.warning("Runtime: %s still running after %ds, abandoned",
+                                job.name, self.stop_timeout)
+            except Exception:
+                # Already logged by the job's done callback.
+                pass
+        self.ioloop.stop()
+
+    def shutdown(self):
+        logging.info("Runtime: draining executor...")
+        self.executor.shutdown(wait=True)
+        for name, executor in sorted(self._serial.items()):
+            logging.info("Runtime: draining %s queue (%d pending)...",
+                         name, executor.stats()["pending"])
+            executor.shutdown(wait=True)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+from core.models import Device
+
+RTT_FIELDS = ("rtt_min", "rtt_max", "rtt_p95", "jitter")
+
+# RTT columns the device table lacks, None until looked up.
+_missing = None
+
+
+def check_rtt_columns(db_engine):
+    """Looks up which RTT columns the device table has.
+
+    The columns come from migrations/001_device_rtt.sql; until it is applied
+    the sweep keeps writing avg and loss_rate only.
+    """
+    global _missing
+    with db_engine:
+        columns = set(column.name for column in
+                      db_engine.get_columns(Device._meta.table_name))
+    missing = set(name for name in RTT_FIELDS
+                  if Device._meta.fields[name].column_name not in columns)
+    if missing:
+        logging.warning("device table lacks %s, RTT stats are not stored; "
+                        "apply migrations/001_device_rtt.sql", ", ".join(sorted(missing)))
+    _missing = missing
+    return not missing
+
+
+def rtt_fields(db_engine, rtt):
+    """Returns the Device update fields for an RTT summary."""
+    if not rtt:
+        return {}
+    if _missing is None:
+        check_rtt_columns(db_engine)
+    return dict((name, rtt[name]) for name in RTT_FIELDS if name not in _missing)
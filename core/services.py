@@ -2,38 +2,105 @@
 # -*- coding: utf-8 -*-
 
 import re
+import time
+import errno
 import socket
 import logging
 import datetime
+import threading
+import collections
 from functools import partial
+from peewee import OperationalError
 from tornado.ioloop import IOLoop
-from tornado.concurrent import run_on_executor
-from concurrent.futures import ThreadPoolExecutor
 
 from core.models import Device, EventMessage
+from core.spool import syslog_record
+from core.profiling import timer, timers
+from core.capture import SYSLOG, TRAP
+
+def update_device_state(db_engine, mac, ip, state):
+    query = Device.update(state=state).where((Device.mac == mac) |
+                                             (Device.host == ip))
+    query.execute(db_engine)
 
 class SyslogService(object):
-    def __init__(self, db_engine, host, port):
+    RECV_SIZE = 1024
+    MAX_LINE = 65536
+    REDO_BATCH = 100
+    # Seconds a partial line may wait for its newline before it is
+    # processed as it is.
+    IDLE_FLUSH = 2.0
+
+    def __init__(self, db_engine, host, port, writer, spool=None, capture=None):
         self.db_engine = db_engine
+        self.spool = spool
+        self.capture = capture
         self.host = host
         self.port = port
         self.fd_map = {}
-        self.executor = ThreadPoolExecutor(10)
-        self.ioloop = IOLoop.instance()
+        self.buffers = {}
+        self.flush_timeouts = {}
+        # Batches are parsed and written one at a time, in arrival order,
+        # so an older state never commits after a newer one.
+        self.writer = writer
+        self.ioloop = IOLoop.current()
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name, count=1):
+        with self._lock:
+            self.counters[name] += count
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def _write(self, updates):
+        try:
+            self._write_once(updates)
+        except OperationalError as err:
+            # Typically a pooled connection the server already dropped;
+            # the pool discards it, so the retry gets a fresh one.
+            logging.warning("SyslogService retrying batch: %s", str(err))
+            self._write_once(updates)
+
+    def _write_once(self, updates):
+        # One pooled connection per batch, handed back when the batch is
+        # done so idle threads hold none and stale_timeout still applies.
+        with timer("syslog.db_write"), self.db_engine:
+            for mac, ip, state in updates:
+                update_device_state(self.db_engine, mac, ip, state)
 
-    @run_on_executor
-    def process_msg(self, msg):
-        mac, ip, state = self.get_mac_and_state(msg)
-        if mac is None:
+    def process_batch(self, msgs, received=None):
+        updates = []
+        for msg in msgs:
+            with timer("syslog.parse"):
+                mac, ip, state = self.get_mac_and_state(msg)
+            if mac is None:
+                self._count("parse_failed")
+                continue
+            updates.append((mac, ip, state))
+        if not updates:
             return
-        
+
         try:
-            with self.db_engine:
-                query = Device.update(state=state).where((Device.mac == mac) |
-                                                         (Device.host == ip))
-                query.execute()
+            if self.spool is None:
+                self._write(updates)
+            elif not self.spool.write_through(
+                    partial(self._write, updates),
+                    [syslog_record(mac, ip, state) for mac, ip, state in updates]):
+                self._count("spooled", len(updates))
+                return
         except Exception as err:
             logging.error("SyslogService process msg: %s", str(err))
+            self._count("db_failed", len(updates))
+            if self.spool is not None:
+                self._count("spooled", len(updates))
+            return
+
+        self._count("updated", len(updates))
+        if received is not None:
+            timers.record("syslog.e2e", time.time() - received)
 
     @staticmethod
     def get_mac_and_state(msg):
@@ -64,36 +131,69 @@ class SyslogService(object):
 
             return (mac[0].strip(), None, state)
             
-    @run_on_executor
     def redo_msg(self, start_time, end_time):
         try:
             message_list = []
             with self.db_engine:
-                for event in EventMessage.select(EventMessage.message).where(EventMessage.created_time.between(start_time, end_time)):
+                query = EventMessage.select(EventMessage.message).where(EventMessage.created_time.between(start_time, end_time))
+                for event in query.execute(self.db_engine):
                     message_list.append(event.message)
-            for m in message_list:
-                self.process_msg(m)
+            for i in range(0, len(message_list), self.REDO_BATCH):
+                self.process_batch(message_list[i:i + self.REDO_BATCH])
         except Exception as err:
             logging.error("SyslogService redo message: %s", str(err))
                     
+    def _process_lines(self, lines):
+        lines = [line for line in lines if line.strip()]
+        if lines:
+            self._count("received", len(lines))
+            if self.writer.submit(self.process_batch, lines, time.time()) is None:
+                self._count("dropped", len(lines))
+
+    def _flush_buffer(self, fd):
+        timeout = self.flush_timeouts.pop(fd, None)
+        if timeout is not None:
+            self.ioloop.remove_timeout(timeout)
+        self._process_lines([self.buffers.pop(fd, "")])
+
+    def _close_client(self, fd, s):
+        self.ioloop.remove_handler(fd)
+        self.fd_map.pop(fd, None)
+        self._flush_buffer(fd)
+        s.close()
+
     def handle_client(self, cli_addr, fd, event):
         s = self.fd_map[fd]
         
         if event & IOLoop.READ:
-            data = s.recv(1024)
+            data = s.recv(self.RECV_SIZE)
             if data:
                 logging.debug("Receive %s from %s", data, cli_addr)
-                self.process_msg(data)
+                if self.capture is not None:
+                    self.capture.record(SYSLOG, data)
+                # One message per line. A partial line waits for the rest
+                # until the client closes or goes quiet for IDLE_FLUSH.
+                timeout = self.flush_timeouts.pop(fd, None)
+                if timeout is not None:
+                    self.ioloop.remove_timeout(timeout)
+                lines = (self.buffers.pop(fd, "") + data).split("\n")
+                tail = lines.pop()
+                if len(tail) >= self.MAX_LINE:
+                    lines.append(tail)
+                elif tail:
+                    self.buffers[fd] = tail
+                    self.flush_timeouts[fd] = self.ioloop.call_later(
+                        self.IDLE_FLUSH, self._flush_buffer, fd)
+                self._process_lines(lines)
             else:
                 logging.debug("Closing %s", cli_addr)
-                self.ioloop.remove_handler(fd)
-                s.close()
+                self._close_client(fd, s)
+                return
         if event & IOLoop.WRITE:
             pass
         if event & IOLoop.ERROR:
             logging.exception("cli: %s", cli_addr)
-            self.ioloop.remove_handler(fd)
-            s.close()
+            self._close_client(fd, s)
 
     def handle_server(self, fd, event):
         s = self.fd_map[fd]
@@ -113,7 +213,7 @@ class SyslogService(object):
 
         if redo_start_time:
             end_time = datetime.datetime.now() + datetime.timedelta(seconds=20)
-            self.redo_msg(redo_start_time, end_time)
+            self.writer.submit(self.redo_msg, redo_start_time, end_time)
         
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -125,10 +225,94 @@ class SyslogService(object):
         self.fd_map[fd] = self.sock
 
         self.ioloop.add_handler(fd, self.handle_server, IOLoop.READ)
-        self.ioloop.start()
 
     def stop(self):
         logging.debug("SyslogService stop...")
-        #self.ioloop.add_callback(self.ioloop.stop)
-        self.ioloop.stop()
-        self.executor.shutdown()
+        for fd, s in self.fd_map.items():
+            self.ioloop.remove_handler(fd)
+            s.close()
+        self.fd_map.clear()
+        for fd in self.buffers.keys():
+            self._flush_buffer(fd)
+
+
+class TrapService(object):
+    """Receives SNMP trap datagrams on the runtime loop.
+
+    Datagrams are read without blocking and pre-filtered on the loop; the
+    rest are handed to the trap callback on the executor, so decoding never
+    stalls the syslog listeners. At most ``max_inflight`` traps are queued
+    or being handled; the excess is dropped and counted.
+    """
+
+    MAX_READS = 64
+
+    def __init__(self, trap_cb, port, executor, ipv6=False, capture=None, max_inflight=1000):
+        self.trap_cb = trap_cb
+        self.port = port
+        self.executor = executor
+        self.ipv6 = ipv6
+        self.capture = capture
+        self.max_inflight = max_inflight
+        self.fd_map = {}
+        self.ioloop = IOLoop.current()
+        self.counters = collections.Counter()
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, inflight=self._inflight)
+
+    def handle_datagram(self, fd, event):
+        s = self.fd_map[fd]
+
+        # Bounded so a trap flood cannot starve the other handlers.
+        for _ in range(self.MAX_READS):
+            try:
+                data, addr = s.recvfrom(65535)
+            except socket.error as err:
+                if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            if self.capture is not None:
+                self.capture.record(TRAP, data)
+            if not self.trap_cb.accept(addr[0], data):
+                continue
+            with self._lock:
+                if self._inflight >= self.max_inflight:
+                    self.counters["dropped"] += 1
+                    continue
+                self._inflight += 1
+                self.counters["queued"] += 1
+            self.executor.submit(self.handle_trap, addr, data, time.time())
+
+    def handle_trap(self, addr, data, received):
+        try:
+            self.trap_cb(None, None, addr, data)
+        finally:
+            with self._lock:
+                self._inflight -= 1
+                self.counters["handled"] += 1
+        timers.record("trap.e2e", time.time() - received)
+
+    def _listen(self, family, address):
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setblocking(0)
+        sock.bind(address)
+        fd = sock.fileno()
+        self.fd_map[fd] = sock
+        self.ioloop.add_handler(fd, self.handle_datagram, IOLoop.READ)
+
+    def start(self):
+        logging.debug("TrapService start...")
+        if self.ipv6:
+            self._listen(socket.AF_INET6, ("::1", self.port))
+        self._listen(socket.AF_INET, ("0.0.0.0", self.port))
+
+    def stop(self):
+        logging.debug("TrapService stop...")
+        for fd, s in self.fd_map.items():
+            self.ioloop.remove_handler(fd)
+            s.close()
+        self.fd_map.clear()
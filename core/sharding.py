@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import calendar
+import datetime
+import hashlib
+import logging
+import os
+import socket
+import time
+
+from core.models import Member
+
+
+def _hash(key):
+    return int(hashlib.md5(str(key)).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    def __init__(self, nodes=None, vnodes=64):
+        self.vnodes = vnodes
+        self._keys = []
+        self._nodes = {}
+        for node in nodes or []:
+            self.add(node)
+
+    def __len__(self):
+        return len(set(self._nodes.values()))
+
+    def add(self, node):
+        for i in range(self.vnodes):
+            key = _hash("%s#%d" % (node, i))
+            if key in self._nodes:
+                continue
+            bisect.insort(self._keys, key)
+            self._nodes[key] = node
+
+    def remove(self, node):
+        for i in range(self.vnodes):
+            key = _hash("%s#%d" % (node, i))
+            if self._nodes.get(key) == node:
+                del self._nodes[key]
+                self._keys.remove(key)
+
+    def get(self, item):
+        if not self._keys:
+            return None
+        idx = bisect.bisect(self._keys, _hash(item)) % len(self._keys)
+        return self._nodes[self._keys[idx]]
+
+
+def cycle_start(now, interval):
+    """Start of the ``interval`` second cycle ``now`` falls in."""
+    seconds = calendar.timegm(now.timetuple())
+    return datetime.datetime.utcfromtimestamp(seconds - seconds % interval)
+
+
+def is_member(member, start):
+    """Whether a member row takes part in the cycle starting at ``start``.
+
+    Only the state at the cycle start counts: the node had joined, held a
+    lease and had not left. Rows change during a cycle, the answer does not.
+    """
+    return (member.joined_time <= start and
+            member.lease_expires >= start and
+            (member.left_time is None or member.left_time > start))
+
+
+class ShardCoordinator(object):
+    """Splits the device sweep across healthchecker nodes.
+
+    Every node keeps a lease in the ``healthchecker_member`` table. All lease
+    and cycle arithmetic uses the database clock, so host clock skew does not
+    change membership. A sweep cycle is aligned to ``interval`` boundaries
+    and the ring is built from the members as of the cycle start (see
+    ``is_member``), so every node builds the same ring whenever it sweeps in
+    that cycle. A node that joins mid-cycle starts with the next cycle; a
+    node that stops keeps its row, marked with ``left_time``, so its share
+    is not swept twice in the cycle it leaves. A crashed node keeps its
+    share until its lease expires, so ``lease_time`` must stay below
+    ``interval``.
+    """
+
+    # Seconds past the boundary the sweep fires, so it lands inside the new
+    # cycle despite the clock offset measured at the last heartbeat.
+    SETTLE = 2
+
+    def __init__(self, db_engine, node_id=None, interval=60, lease_time=30, vnodes=64):
+        self.db_engine = db_engine
+        self.node_id = node_id or "%s:%d" % (socket.gethostname(), os.getpid())
+        self.interval = interval
+        self.lease_time = lease_time
+        self.vnodes = vnodes
+        self._clock_offset = 0.0
+        self._ring = None
+        self._ring_members = None
+        if lease_time >= interval:
+            logging.warning("ShardCoordinator: lease_time %ds is not below the %ds interval, "
+                            "a crashed node's share is skipped for more than one cycle",
+                            lease_time, interval)
+
+    def _db_now(self):
+        """Current time on the database clock; also tracks the host offset."""
+        before = time.time()
+        now = self.db_engine.execute_sql("SELECT UTC_TIMESTAMP(6)").fetchone()[0]
+        self._clock_offset = (calendar.timegm(now.timetuple()) + now.microsecond / 1e6 -
+                              (before + time.time()) / 2)
+        return now
+
+    def _renew(self, now, **fields):
+        lease_expires = now + datetime.timedelta(seconds=self.lease_time)
+        updated = Member.update(heartbeat_time=now, lease_expires=lease_expires, **fields).where(
+            Member.node_id == self.node_id).execute()
+        if not updated:
+            Member.insert(node_id=self.node_id, joined_time=now, heartbeat_time=now,
+                          lease_expires=lease_expires).execute()
+
+    def start(self):
+        with self.db_engine:
+            Member.create_table(safe=True)
+            now = self._db_now()
+            self._renew(now, joined_time=now, left_time=None)
+        logging.info("ShardCoordinator joined as %s", self.node_id)
+
+    def stop(self):
+        try:
+            with self.db_engine:
+                Member.update(left_time=self._db_now()).where(
+                    Member.node_id == self.node_id).execute()
+        except Exception as err:
+            logging.error("ShardCoordinator leave: %s", str(err))
+        logging.info("ShardCoordinator left as %s", self.node_id)
+
+    def __call__(self):
+        try:
+            self.heartbeat()
+        except Exception as err:
+            logging.error("ShardCoordinator heartbeat: %s", str(err))
+
+    def heartbeat(self):
+        with self.db_engine:
+            now = self._db_now()
+            # A node whose lease lapsed rejoins with the next cycle instead of
+            # reappearing in the middle of this one.
+            Member.update(joined_time=now).where(Member.node_id == self.node_id,
+                                                 Member.lease_expires < now).execute()
+            self._renew(now)
+            # Rows that cannot affect the current cycle any more.
+            horizon = now - datetime.timedelta(seconds=self.interval)
+            Member.delete().where((Member.lease_expires < horizon) |
+                                  (Member.left_time < horizon)).execute()
+
+    def next_cycle_delay(self):
+        """Seconds until the next cycle boundary on the database clock."""
+        now = time.time() + self._clock_offset
+        return self.interval - now % self.interval + self.SETTLE
+
+    def members(self):
+        with self.db_engine:
+            start = cycle_start(self._db_now(), self.interval)
+            return set(m.node_id for m in Member.select() if is_member(m, start))
+
+    def ring(self):
+        members = self.members()
+        if members != self._ring_members:
+            logging.info("ShardCoordinator members: %s", ", ".join(sorted(members)))
+            self._ring = HashRing(members, self.vnodes)
+            self._ring_members = members
+        return self._ring
+
+    def owns(self, device_id, ring=None):
+        if ring is None:
+            ring = self.ring()
+        return ring.get(device_id) == self.node_id
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import datetime
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from core.exceptions import SpoolError
+
+MAGIC = "HCSP"
+HEADER = struct.Struct("<4sQ")
+HEADER_SIZE = 16
+RECORD = struct.Struct("<II")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+FSYNC_POLICIES = ("always", "never")
+
+
+class Spool(object):
+    """Append-only, memory-mapped spool of pending state updates.
+
+    Layout: a 16 byte header holding the magic and the offset of the first
+    unconsumed record, followed by ``<length><crc32><json>`` records. Every
+    append also writes a zero length terminator, so stale bytes left behind
+    a reset are never read back as records. Consumed space is reclaimed by
+    moving the pending records back to the front once they fit there.
+    """
+
+    def __init__(self, path, max_size=64 * 1024 * 1024, fsync="always"):
+        if fsync not in FSYNC_POLICIES:
+            raise SpoolError("Invalid fsync policy %s" % fsync)
+        self.path = path
+        self.fsync = fsync
+        self.dropped = 0
+        self._full = False
+        self._lock = threading.Lock()
+        self._gate = threading.Lock()
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE
+        self._file = open(path, "r+b" if exists else "w+b")
+        if os.path.getsize(path) < max_size:
+            self._file.truncate(max_size)
+        # A spool written with a larger max_size is mapped whole, so nothing
+        # pending past the configured size is lost.
+        self.max_size = os.path.getsize(path)
+        self._mm = mmap.mmap(self._file.fileno(), self.max_size)
+
+        magic, head = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or not HEADER_SIZE <= head <= self.max_size:
+            if magic == MAGIC:
+                logging.warning("Spool %s has invalid head %d, discarding it", path, head)
+            self._reset()
+        else:
+            self._head = self._tail = head
+            for _, end in self._scan(head):
+                self._tail = end
+
+        if self.max_size > max_size:
+            if self.pending():
+                logging.warning("Spool %s is %d bytes, over max_size %d; keeping that size "
+                                "until the pending records are replayed",
+                                path, self.max_size, max_size)
+            else:
+                self._mm.close()
+                self._file.truncate(max_size)
+                self.max_size = max_size
+                self._mm = mmap.mmap(self._file.fileno(), max_size)
+                self._reset()
+
+        if self.pending():
+            logging.info("Spool %s has %d bytes pending", path, self._tail - self._head)
+
+    def _reset(self):
+        self._mm[HEADER_SIZE:HEADER_SIZE + RECORD.size] = "\0" * RECORD.size
+        self._head = self._tail = HEADER_SIZE
+        self._write_head(HEADER_SIZE)
+
+    def _write_head(self, head):
+        HEADER.pack_into(self._mm, 0, MAGIC, head)
+        self._flush()
+
+    def _flush(self):
+        if self.fsync == "always":
+            self._mm.flush()
+
+    def _compact(self):
+        """Moves the pending records to the front of the spool.
+
+        Only done when they fit in the consumed space ahead of them, so the
+        copy never overwrites a pending record and a crash part way leaves
+        the head pointing at intact data. Otherwise the head just advances
+        and a later consume compacts.
+        """
+        pending = self._tail - self._head
+        if self._head == HEADER_SIZE or pending > self._head - HEADER_SIZE:
+            return False
+        if pending:
+            self._mm.move(HEADER_SIZE, self._head, pending)
+        end = HEADER_SIZE + pending
+        self._mm[end:end + RECORD.size] = "\0" * RECORD.size
+        self._flush()
+        self._head, self._tail = HEADER_SIZE, end
+        self._write_head(HEADER_SIZE)
+        return True
+
+    def _scan(self, offset, end=None):
+        end = self.max_size if end is None else end
+        while offset + RECORD.size <= end:
+            length, crc = RECORD.unpack_from(self._mm, offset)
+            start = offset + RECORD.size
+            if not length or start + length > end:
+                return
+            data = self._mm[start:start + length]
+            if zlib.crc32(data) & 0xffffffff != crc:
+                logging.warning("Spool %s corrupt record at %d", self.path, offset)
+                return
+            yield data, start + length
+            offset = start + length
+
+    def pending(self):
+        return self._tail > self._head
+
+    def size(self):
+        return self._tail - self._head
+
+    def stats(self):
+        return {"pending_bytes": self.size(), "max_size": self.max_size,
+                "dropped": self.dropped}
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        dropped = 0
+        with self._lock:
+            offset = self._tail
+            for record in records:
+                data = json.dumps(record)
+                end = offset + RECORD.size + len(data)
+                if end + RECORD.size > self.max_size:
+                    dropped += 1
+                    continue
+                self._mm[offset + RECORD.size:end] = data
+                self._mm[end:end + RECORD.size] = "\0" * RECORD.size
+                RECORD.pack_into(self._mm, offset, len(data), zlib.crc32(data) & 0xffffffff)
+                offset = end
+            self._tail = offset
+            self.dropped += dropped
+            self._flush()
+            warn = dropped and not self._full
+            self._full = self._full or bool(dropped)
+        if warn:
+            logging.error("Spool %s full, dropping records until replayed", self.path)
+
+    def write_through(self, write, records):
+        """Runs ``write`` unless updates are already spooled.
+
+        ``records`` are spooled instead while anything is pending, and when
+        ``write`` raises, which is then re-raised. Writers are serialized
+        from the pending check to the append, so a newer update can never
+        reach the database ahead of an older one on its way to the spool.
+        Returns True if ``write`` went through.
+        """
+        with self._gate:
+            if self.pending():
+                self.extend(records)
+                return False
+            try:
+                write()
+            except Exception:
+                self.extend(records)
+                raise
+            return True
+
+    def snapshot(self):
+        """Returns (records, offset); pass offset to consume() once applied."""
+        with self._lock:
+            head, tail = self._head, self._tail
+            records = [json.loads(data) for data, _ in self._scan(head, tail)]
+        return records, tail
+
+    def consume(self, offset):
+        """Marks everything before ``offset`` applied and reclaims its space."""
+        with self._lock:
+            # Records only move here, so the offset from snapshot() is
+            # still valid; anything appended since stays pending.
+            offset = max(self._head, min(offset, self._tail))
+            self._head = offset
+            self._write_head(offset)
+            self._compact()
+            self._full = False
+
+    def close(self):
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+
+
+def encode_time(value):
+    return value.strftime(TIME_FORMAT)
+
+
+def decode_time(value):
+    return datetime.datetime.strptime(value, TIME_FORMAT)
+
+
+def device_record(idx, host, old_state, state, avg, loss_rate, last_time, rtt=None):
+    return {"kind": "device", "id": idx, "host": host, "old_state": old_state,
+            "state": state, "avg": avg, "loss_rate": loss_rate,
+            "last_time": encode_time(last_time), "rtt": rtt}
+
+
+def syslog_record(mac, ip, state):
+    return {"kind": "syslog", "mac": mac, "ip": ip, "state": state}
+
+
+def collapse(records):
+    """Keeps the final update per device, ordered by when it was last seen.
+
+    The first ``old_state`` of a device is kept so a linkUp/linkDown message
+    is still written when the collapsed update changes its state.
+    """
+    collapsed = collections.OrderedDict()
+    for record in records:
+        if record["kind"] == "device":
+            key = ("device", record["id"])
+        else:
+            key = ("syslog", record["mac"], record["ip"])
+        previous = collapsed.pop(key, None)
+        if previous is not None and "old_state" in previous:
+            record = dict(record, old_state=previous["old_state"])
+        collapsed[key] = record
+    return collapsed.values()
+
+
+class SpoolReplayer(object):
+    """Applies spooled updates once the database is reachable again.
+
+    Writers keep queueing behind the spool while anything is pending, so
+    each run drains in rounds until the spool is empty; the rounds shrink
+    as long as replay outpaces new traffic, after which writers go to the
+    database directly again.
+    """
+
+    MAX_ROUNDS = 10
+
+    def __init__(self, spool, db_engine):
+        self.spool = spool
+        self.db_engine = db_engine
+
+    def __call__(self):
+        try:
+            self._call()
+        except Exception as err:
+            logging.exception("SpoolReplayer Failed: %s", err)
+
+    def _call(self):
+        for _ in range(self.MAX_ROUNDS):
+            if not self.spool.pending() or not self._replay():
+                return
+        logging.warning("SpoolReplayer still %d bytes behind after %d rounds",
+                        self.spool.size(), self.MAX_ROUNDS)
+
+    def _replay(self):
+        # Imported here as callbacks and services import the record helpers.
+        from core.callbacks import update_device_metrics
+        from core.services import update_device_state
+
+        records, offset = self.spool.snapshot()
+        collapsed = collapse(records)
+        try:
+            with self.db_engine:
+                for record in collapsed:
+                    if record["kind"] == "device":
+                        update_device_metrics(self.db_engine, record["id"], record["host"],
+                                              record["old_state"], record["state"],
+                                              record["avg"], record["loss_rate"],
+                                              decode_time(record["last_time"]),
+                                              record.get("rtt"))
+                    else:
+                        update_device_state(self.db_engine, record["mac"],
+                                            record["ip"], record["state"])
+        except Exception as err:
+            logging.warning("SpoolReplayer database still unavailable: %s", str(err))
+            return False
+
+        self.spool.consume(offset)
+        logging.info("SpoolReplayer replayed %d records as %d updates",
+                     len(records), len(collapsed))
+        return True
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+
+from tornado.web import Application, HTTPError, RequestHandler
+
+
+class StatsHandler(RequestHandler):
+    def initialize(self, providers):
+        self.providers = providers
+
+    def get(self):
+        stats = {}
+        for name, provider in self.providers.items():
+            try:
+                stats[name] = provider()
+            except Exception as err:
+                stats[name] = {"error": str(err)}
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(stats, sort_keys=True))
+
+
+class ProfileHandler(RequestHandler):
+    def initialize(self, profiler):
+        self.profiler = profiler
+
+    def post(self):
+        seconds = self.get_argument("seconds", "30")
+        try:
+            prefix = self.profiler.start(int(seconds))
+        except ValueError:
+            raise HTTPError(400, "Invalid seconds %s" % seconds)
+        if prefix is None:
+            raise HTTPError(409, "Profiler already running")
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"output": prefix}))
+
+
+class CaptureHandler(RequestHandler):
+    def initialize(self, capture):
+        self.capture = capture
+
+    def post(self):
+        seconds = self.get_argument("seconds", "60")
+        try:
+            path = self.capture.start(int(seconds))
+        except ValueError:
+            raise HTTPError(400, "Invalid seconds %s" % seconds)
+        if path is None:
+            raise HTTPError(409, "Capture already running")
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"output": path}))
+
+
+class StatsServer(object):
+    """Serves monitoring counters as JSON on the stats port.
+
+    Subsystems register a callable returning a dict; ``GET /stats`` returns
+    all of them keyed by name. The server runs on the shared IOLoop.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = int(port)
+        self.providers = {}
+        self.handlers = [(r"/stats", StatsHandler, dict(providers=self.providers))]
+
+    def register(self, name, provider):
+        self.providers[name] = provider
+
+    def add_handler(self, pattern, handler, kwargs=None):
+        self.handlers.append((pattern, handler, kwargs or {}))
+
+    def start(self):
+        app = Application(self.handlers)
+        app.listen(self.port, address=self.host)
+        logging.info("StatsServer listen on %s:%d", self.host, self.port)
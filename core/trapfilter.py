@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import binascii
+import collections
+import random
+import socket
+import threading
+
+from core.exceptions import ConfigError
+
+# (message version, PDU tag) pairs TrapperCallback handles: a v1 Trap-PDU
+# and a v2c SNMPv2-Trap-PDU.
+TRAP_PDUS = set([(0, 0xa4), (1, 0xa7)])
+
+CACHE_SIZE = 10000
+
+
+def _header(data, offset):
+    """Returns (tag, value offset, value length) of the BER TLV at offset."""
+    if offset + 2 > len(data):
+        return None
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7f
+        if not 1 <= count <= 4 or offset + count > len(data):
+            return None
+        length = 0
+        for byte in data[offset:offset + count]:
+            length = (length << 8) | byte
+        offset += count
+    if offset + length > len(data):
+        return None
+    return tag, offset, length
+
+
+def peek(data):
+    """Reads (version, community, PDU tag) from a raw SNMP message.
+
+    Only the outer SEQUENCE, the version INTEGER, the community OCTET STRING
+    and the tag of the PDU are looked at. Returns None for anything that is
+    not shaped like a v1/v2c message.
+    """
+    data = bytearray(data)
+    header = _header(data, 0)
+    if header is None or header[0] != 0x30:
+        return None
+
+    header = _header(data, header[1])
+    if header is None or header[0] != 0x02 or not 1 <= header[2] <= 4:
+        return None
+    _, offset, length = header
+    version = 0
+    for byte in data[offset:offset + length]:
+        version = (version << 8) | byte
+
+    header = _header(data, offset + length)
+    if header is None or header[0] != 0x04:
+        return None
+    _, offset, length = header
+    community = str(data[offset:offset + length])
+
+    offset += length
+    if offset >= len(data):
+        return None
+    return version, community, data[offset]
+
+
+def _address(host):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return family, int(binascii.hexlify(socket.inet_pton(family, host)), 16)
+
+
+def _network(cidr):
+    host, _, prefix = cidr.partition("/")
+    try:
+        family, address = _address(host)
+    except socket.error:
+        raise ConfigError("Invalid network %s" % cidr)
+    bits = 32 if family == socket.AF_INET else 128
+    prefix = int(prefix) if prefix else bits
+    if not 0 <= prefix <= bits:
+        raise ConfigError("Invalid network %s" % cidr)
+    mask = ((1 << prefix) - 1) << (bits - prefix)
+    return family, address & mask, mask
+
+
+class TrapFilter(object):
+    """Drops unwanted trap datagrams before they are BER decoded.
+
+    Checks, in order: message shape, version/PDU type, community, the
+    per-source deny and allow lists, then ``sample_rate``. Drop counters
+    are kept per reason.
+    """
+
+    def __init__(self, community=None, allow=None, deny=None, sample_rate=1.0, counters=None):
+        self.community = community
+        self.allow = [_network(cidr) for cidr in allow or []]
+        self.deny = [_network(cidr) for cidr in deny or []]
+        self.sample_rate = float(sample_rate)
+        self.counters = counters if counters is not None else collections.Counter()
+        self._lock = threading.Lock()
+        self._sources = {}
+
+    @staticmethod
+    def from_config(config, community=None, counters=None):
+        trap_filter = config.get("trap_filter") or {}
+        return TrapFilter(community,
+                          trap_filter.get("allow"),
+                          trap_filter.get("deny"),
+                          trap_filter.get("sample_rate", 1.0),
+                          counters)
+
+    def _source_allowed(self, host):
+        allowed = self._sources.get(host)
+        if allowed is None:
+            try:
+                family, address = _address(host)
+            except socket.error:
+                return False
+            matches = lambda networks: any(f == family and address & mask == net
+                                           for f, net, mask in networks)
+            allowed = not matches(self.deny) and (not self.allow or matches(self.allow))
+            if len(self._sources) >= CACHE_SIZE:
+                self._sources.clear()
+            self._sources[host] = allowed
+        return allowed
+
+    def check(self, host, data):
+        """Returns the reason to drop the datagram, or None to keep it."""
+        reason = self._check(host, data)
+        with self._lock:
+            self.counters[reason or "accepted"] += 1
+        return reason
+
+    def _check(self, host, data):
+        header = peek(data)
+        if header is None:
+            return "malformed"
+        version, community, pdu_tag = header
+        if (version, pdu_tag) not in TRAP_PDUS:
+            return "not_trap"
+        if self.community and community != self.community:
+            return "community"
+        if (self.allow or self.deny) and not self._source_allowed(host):
+            return "source"
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return "sampled"
+        return None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
@@ -95,7 +95,7 @@ def decode_date(hex_string):
 def get_loglevel(args):
     verbose = args.verbose * 10
     quiet = args.quiet * 10
-    return logging.getLogger().level - verbose + quiet
+    return logging.INFO - verbose + quiet
 
 
 def utcnow():
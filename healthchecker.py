@@ -3,21 +3,25 @@
 
 import argparse
 import logging
+import os
 import datetime
 
 import oid_translate
-from pysnmp.carrier.asynsock.dispatch import AsynsockDispatcher
-from pysnmp.carrier.asynsock.dgram import udp, udp6
-
-import multiprocessing.pool
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from playhouse.pool import PooledMySQLDatabase
 
 from core.callbacks import TrapperCallback, FPingCallback
-from core.services import SyslogService
+from core.services import SyslogService, TrapService
+from core.runtime import Runtime
+from core.trapfilter import TrapFilter
 from core.config import Config
-from core.models import Target, FPingMessage, Device, EventMessage, Port
+from core.db import DatabasePools
+from core.stats import StatsServer, ProfileHandler, CaptureHandler
+from core.capture import Capture
+from core.profiling import Profiler, timers
+from core.reload import ConfigReloader
+from core.sharding import ShardCoordinator
+from core.spool import Spool, SpoolReplayer
+from core.models import Target, FPingMessage, Device, EventMessage, Port, Member
+from core.schema import check_rtt_columns
 from core.utils import get_loglevel
 from core import __version__
 
@@ -28,6 +32,8 @@ def main():
     parser = argparse.ArgumentParser(description="HEALTH CHECKER.")
     parser.add_argument("-c", "--config", default="/etc/healthchecker.yaml",
                         help="Path to config file.")
+    parser.add_argument("-n", "--node-id", default=None,
+                        help="Shard node id, overrides shard.node_id in config.")
     parser.add_argument("-v", "--verbose", action="count", default=0, help="Increase logging verbosity.")
     parser.add_argument("-q", "--quiet", action="count", default=0, help="Decrease logging verbosity.")
     parser.add_argument("-V", "--version", action="version",
@@ -36,15 +42,21 @@ def main():
 
     args = parser.parse_args()
 
+    logging.basicConfig(filename=LOGFILE, level=get_loglevel(args),
+                        format=LOGFORMAT)
+
     oid_translate.load_mibs()
 
     config = Config.from_file(args.config)
 
-    db_host, db_port, db_name, db_user, db_passwd = config.get_database_config()
-    db_engine = PooledMySQLDatabase(db_name, **{'host': db_host, 'port': db_port,
-                                                'password': db_passwd, 'user': db_user})
-    models = [Target, FPingMessage, Device, EventMessage, Port]
-    db_engine.bind(models)
+    db_pools = DatabasePools(config)
+    models = [Target, FPingMessage, Device, EventMessage, Port, Member]
+    db_pools.bind(models)
+    try:
+        check_rtt_columns(db_pools["sweep"])
+    except Exception as err:
+        # Looked up again on the first RTT write.
+        logging.error("Schema check failed: %s", str(err))
     
     community = config["community"]
     if not community:
@@ -52,71 +64,93 @@ def main():
     ipv6_server = config["ipv6"]
     if not ipv6_server:
         ipv6_server = None
-    
-    trap_cb = TrapperCallback(db_engine, config, community)
 
-    logging.basicConfig(filename=LOGFILE, level=10, #get_loglevel(args),
-                        format=LOGFORMAT)
+    runtime = Runtime(int(config.get("workers") or 10))
+    runtime.install()
 
-    transport_dispatcher = AsynsockDispatcher()
-    transport_dispatcher.registerRecvCbFun(trap_cb)
-    if ipv6_server:
-        transport_dispatcher.registerTransport(
-            udp6.domainName, udp6.Udp6SocketTransport().openServerMode(("::1", int(config["trap_port"])))
-        )
-    transport_dispatcher.registerTransport(
-        udp.domainName, udp.UdpSocketTransport().openServerMode(("0.0.0.0", int(config["trap_port"])))
-    )
-    transport_dispatcher.jobStarted(1)
-
-    process_count = config['process_count']
-    if not process_count:
-        process_count = (multiprocessing.cpu_count() * 2 + 1) if (multiprocessing.cpu_count() * 2 + 1) < 11 else 10
-    logging.info("multiprocess count is : %s" % process_count)
-
-    fping_count = int(config['fping_count'])
-    if not fping_count:
-        fping_count = 5
-    logging.info("fping count is : %d" % fping_count)
+    trap_filter = TrapFilter.from_config(config, community)
+    trap_cb = TrapperCallback(db_pools["traps"], config, community, trap_filter)
+    capture = Capture(config.get("capture_dir", os.path.dirname(LOGFILE)), runtime.ioloop)
+    trap_service = TrapService(trap_cb, int(config["trap_port"]), runtime.executor,
+                               ipv6_server, capture, int(config.get("trap_max_inflight") or 1000))
 
-    interval_time = int(config['interval_time'])
-    if not interval_time:
-        interval_time = 1
+    process_count, fping_count, interval_time = config.get_scheduler_config()
+    logging.info("probe concurrency is : %s" % process_count)
+    logging.info("fping count is : %d" % fping_count)
     
-    fping_cb = FPingCallback(db_engine)
-    scheduler = BackgroundScheduler()
-    trigger= IntervalTrigger(minutes=interval_time) # FIX PYINSTALL BUG
-    scheduler.add_job(fping_cb, trigger, args=(process_count, fping_count), max_instances=10)
-    #scheduler.add_job(fping_cb, trigger='interval', args=(process_count, fping_count),
-    #                  max_instances=10, minutes=interval_time)
+    spool = None
+    spool_path, spool_max_size, spool_fsync, replay_interval = config.get_spool_config()
+    if spool_path:
+        spool = Spool(spool_path, spool_max_size, spool_fsync)
+
+    profiler = Profiler(config.get("profile_dir", os.path.dirname(LOGFILE)), runtime.ioloop)
+    profiler.install()
+
+    coordinator = None
+    shard_enabled, node_id, lease_time, vnodes = config.get_shard_config()
+    if shard_enabled:
+        coordinator = ShardCoordinator(db_pools["sweep"], args.node_id or node_id,
+                                       interval_time * 60, lease_time, vnodes)
+        coordinator.start()
+
+    fping_cb = FPingCallback(db_pools["sweep"], runtime, coordinator, spool)
+    # Sharded sweeps start on cycle boundaries so the frozen ring matches.
+    runtime.add_interval("sweep", interval_time * 60, fping_cb,
+                         (process_count, fping_count, config.get_rtt_thresholds()),
+                         delay=coordinator.next_cycle_delay if coordinator is not None else None)
+    if coordinator is not None:
+        runtime.add_interval("heartbeat", max(1, lease_time // 3), coordinator, blocking=True)
+    if spool is not None:
+        runtime.add_interval("replay", replay_interval,
+                             SpoolReplayer(spool, db_pools["sweep"]), blocking=True)
 
     ## syslog service
     host = '127.0.0.1'
     port = 8889
-    syslog_service = SyslogService(db_engine, host, port)
+    syslog_writer = runtime.serial("syslog", int(config.get("syslog_max_pending") or 1000))
+    syslog_service = SyslogService(db_pools["syslog"], host, port, syslog_writer,
+                                   spool, capture)
+
+    stats_server = StatsServer(config.get("stats_host", "127.0.0.1"), config["stats_port"])
+    stats_server.register("db_pools", db_pools.stats)
+    stats_server.register("timers", timers.stats)
+    stats_server.register("sweep_rtt", fping_cb.rtt_stats)
+    stats_server.register("trap_filter", lambda: trap_cb.trap_filter.stats())
+    stats_server.register("syslog", syslog_service.stats)
+    stats_server.register("traps", trap_service.stats)
+    stats_server.register("queues", runtime.stats)
+    stats_server.add_handler(r"/profile", ProfileHandler, dict(profiler=profiler))
+    stats_server.add_handler(r"/capture", CaptureHandler, dict(capture=capture))
+    if spool is not None:
+        stats_server.register("spool", spool.stats)
+
+    reloader = ConfigReloader(args.config, config, trap_cb, runtime, coordinator)
+    reloader.install()
+
+    # Listeners close first so nothing new is queued while the executor drains.
+    runtime.add_stop_callback(trap_service.stop)
+    runtime.add_stop_callback(syslog_service.stop)
+    runtime.add_stop_callback(capture.stop)
 
-    TRAP = False
     try:
-        scheduler.start()
-        if TRAP:#TODO new thread
-            transport_dispatcher.runDispatcher()
-        else:
-            #redo_start_time = datetime.datetime.now() + datetime.timedelta(seconds=-20)
-            redo_start_time = config.get("redo_start_time")
-            if redo_start_time is None:
-                redo_start_time = False
-            syslog_service.start(redo_start_time)
+        stats_server.start()
+        trap_service.start()
+        #redo_start_time = datetime.datetime.now() + datetime.timedelta(seconds=-20)
+        redo_start_time = config.get("redo_start_time")
+        if redo_start_time is None:
+            redo_start_time = False
+        syslog_service.start(redo_start_time)
+        runtime.start()
     except KeyboardInterrupt:
         pass
     finally:
-        logging.info("Shutdown Scheduler...")
-        scheduler.shutdown()
-
-        if TRAP:
-            logging.info("Stopping Transport Dispatcher...")
-            transport_dispatcher.closeDispatcher()
-        else:
-            syslog_service.stop()
+        logging.info("Shutdown Runtime...")
+        runtime.shutdown()
+        if coordinator is not None:
+            coordinator.stop()
+        if spool is not None:
+            spool.close()
+        db_pools.close_all()
         logging.info("Bye")
 
 if __name__ == "__main__":
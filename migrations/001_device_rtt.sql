@@ -0,0 +1,8 @@
+-- RTT statistics written by the sweep since the RTT summary change.
+-- healthchecker runs without them, but only stores avg/loss_rate until
+-- this is applied and the daemon restarted.
+ALTER TABLE `device`
+    ADD COLUMN `rtt_min` DOUBLE NULL,
+    ADD COLUMN `rtt_max` DOUBLE NULL,
+    ADD COLUMN `rtt_p95` DOUBLE NULL,
+    ADD COLUMN `jitter` DOUBLE NULL;
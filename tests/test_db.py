@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from core.db import DatabasePools
+
+
+class StubConfig(object):
+    def __init__(self, db_pools=None):
+        self.db_pools = db_pools
+
+    def get_database_config(self):
+        return ("127.0.0.1", 3306, "healthchecker", "user", "secret")
+
+    def get(self, key, default=None):
+        return self.db_pools if key == "db_pools" else default
+
+
+class DatabasePoolsTest(unittest.TestCase):
+    def test_defaults(self):
+        pools = DatabasePools(StubConfig())
+        self.assertEqual(pools["syslog"].connect_params["read_timeout"], 10)
+        self.assertEqual(pools["syslog"].connect_params["write_timeout"], 10)
+        self.assertEqual(pools["sweep"].connect_params["read_timeout"], 30)
+        self.assertEqual(pools["traps"]._max_connections, 4)
+
+    def test_overrides(self):
+        pools = DatabasePools(StubConfig({"sweep": {"query_timeout": 5, "max_connections": 2},
+                                          "syslog": {"query_timeout": 0}}))
+        self.assertEqual(pools["sweep"].connect_params["read_timeout"], 5)
+        self.assertEqual(pools["sweep"].connect_params["write_timeout"], 5)
+        self.assertEqual(pools["sweep"]._max_connections, 2)
+        self.assertNotIn("read_timeout", pools["syslog"].connect_params)
+
+
+if __name__ == "__main__":
+    unittest.main()
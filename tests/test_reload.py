@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from core.config import Config
+from core.reload import ConfigReloader
+from core.trapfilter import TrapFilter
+
+BASE = {
+    "config": {
+        "db_host": "127.0.0.1", "db_port": 3306, "db_name": "healthchecker",
+        "db_user": "user", "db_passwd": "secret",
+        "trap_port": 162, "stats_port": 8890,
+        "community": "public",
+        "process_count": 4, "fping_count": 5, "interval_time": 1,
+    },
+    "traphandlers": {
+        ".1.3.6.1.6.3.1.1.5.3": {"severity": "critical"},
+    },
+}
+
+
+class StubTrapCallback(object):
+    def __init__(self, config):
+        self.config = config
+        self.community = config.get("community")
+        self.trap_filter = TrapFilter.from_config(config, self.community)
+
+
+class StubRuntime(object):
+    def __init__(self):
+        self.calls = []
+
+    def modify(self, name, *args):
+        self.calls.append(("modify", name) + args)
+
+    def reschedule(self, name, seconds):
+        self.calls.append(("reschedule", name, seconds))
+
+
+class StubCoordinator(object):
+    interval = 60
+
+
+class CapturingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class ConfigReloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "healthchecker.yaml")
+        self._write(BASE)
+        config = Config.from_file(self.path)
+        self.trap_cb = StubTrapCallback(config)
+        self.runtime = StubRuntime()
+        self.coordinator = StubCoordinator()
+        self.reloader = ConfigReloader(self.path, config, self.trap_cb,
+                                       self.runtime, self.coordinator)
+        self.warnings = CapturingHandler()
+        logging.getLogger().addHandler(self.warnings)
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.warnings)
+        shutil.rmtree(self.tmp)
+
+    def _write(self, document):
+        with open(self.path, "w") as config_file:
+            yaml.safe_dump(document, config_file)
+
+    def _reload(self, **changes):
+        document = {"config": dict(BASE["config"], **changes.pop("config", {})),
+                    "traphandlers": changes.pop("traphandlers", BASE["traphandlers"])}
+        self._write(document)
+        self.reloader.reload()
+
+    def test_nothing_changed(self):
+        trap_filter = self.trap_cb.trap_filter
+        self._reload()
+        self.assertIs(self.trap_cb.trap_filter, trap_filter)
+        self.assertEqual(self.runtime.calls, [])
+
+    def test_handler_only_change(self):
+        trap_filter = self.trap_cb.trap_filter
+        old_config = self.trap_cb.config
+        self._reload(traphandlers={".1.3.6.1.6.3.1.1.5.3": {"severity": "warning"}})
+        self.assertIsNot(self.trap_cb.config, old_config)
+        self.assertEqual(self.trap_cb.config.handlers[".1.3.6.1.6.3.1.1.5.3"]["severity"],
+                         "warning")
+        self.assertIsNot(self.trap_cb.trap_filter, trap_filter)
+        self.assertEqual(self.trap_cb.community, "public")
+        self.assertEqual(self.runtime.calls, [])
+
+    def test_community_change(self):
+        counters = self.trap_cb.trap_filter.counters
+        counters["accepted"] += 3
+        self._reload(config={"community": "private"})
+        self.assertEqual(self.trap_cb.community, "private")
+        self.assertEqual(self.trap_cb.trap_filter.community, "private")
+        # Drop counters survive the rebuild.
+        self.assertIs(self.trap_cb.trap_filter.counters, counters)
+        self.assertEqual(self.runtime.calls, [])
+
+    def test_interval_change(self):
+        self._reload(config={"interval_time": 5})
+        self.assertEqual(self.runtime.calls, [("modify", "sweep", 4, 5, {}),
+                                              ("reschedule", "sweep", 300)])
+        self.assertEqual(self.coordinator.interval, 300)
+        self.assertEqual(self.reloader.config["interval_time"], 5)
+
+    def test_fping_count_change_does_not_reschedule(self):
+        self._reload(config={"fping_count": 10})
+        self.assertEqual(self.runtime.calls, [("modify", "sweep", 4, 10, {})])
+        self.assertEqual(self.coordinator.interval, 60)
+
+    def test_restart_only_change(self):
+        trap_filter = self.trap_cb.trap_filter
+        self._reload(config={"trap_port": 1162})
+        self.assertEqual(self.warnings.messages,
+                         ["ConfigReloader: trap_port changed, restart required to apply"])
+        self.assertIs(self.trap_cb.trap_filter, trap_filter)
+        self.assertEqual(self.runtime.calls, [])
+        self.assertEqual(self.reloader.config["trap_port"], 162)
+
+        # Still not applied, so a second reload warns again.
+        self._reload(config={"trap_port": 1162})
+        self.assertEqual(len(self.warnings.messages), 2)
+
+    def test_restart_key_kept_while_others_apply(self):
+        self._reload(config={"trap_port": 1162, "community": "private"})
+        self.assertEqual(self.trap_cb.community, "private")
+        self.assertEqual(self.reloader.config["trap_port"], 162)
+        self.assertEqual(self.reloader.config["community"], "private")
+
+    def test_invalid_file_keeps_running_config(self):
+        with open(self.path, "w") as config_file:
+            config_file.write("config: {community: private}\n")
+        config = self.reloader.config
+        self.reloader.reload()
+        self.assertIs(self.reloader.config, config)
+        self.assertEqual(self.trap_cb.community, "public")
+
+
+class ConfigTest(unittest.TestCase):
+    def test_diff_and_merge(self):
+        running = Config(dict(BASE["config"]), None)
+        loaded = Config(dict(BASE["config"], trap_port=1162, workers=4), None)
+        self.assertEqual(running.diff(loaded), set(["trap_port", "workers"]))
+        merged = loaded.merge(running, ["trap_port", "workers"])
+        self.assertEqual(running.diff(merged), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
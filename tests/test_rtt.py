@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from core import rtt
+from core.rtt import STATS, RttBuffer, exceeded
+
+NONE = dict((name, None) for name in STATS)
+
+
+class SummarizePythonTest(unittest.TestCase):
+    """Runs against the pure-Python path; the NumPy subclass re-runs it."""
+
+    use_numpy = False
+
+    def setUp(self):
+        self._numpy = rtt.numpy
+        if not self.use_numpy:
+            rtt.numpy = None
+
+    def tearDown(self):
+        rtt.numpy = self._numpy
+
+    def assertStats(self, actual, expected):
+        self.assertEqual(sorted(actual), sorted(expected))
+        for name in STATS:
+            if expected[name] is None:
+                self.assertIsNone(actual[name], name)
+            else:
+                self.assertAlmostEqual(actual[name], expected[name], places=9, msg=name)
+
+    def test_empty(self):
+        hosts, sweep = RttBuffer(3).summarize()
+        self.assertEqual(hosts, [])
+        self.assertStats(sweep, NONE)
+
+    def test_rows(self):
+        buf = RttBuffer(4)
+        buf.append([1.0, 2.0, 4.0, 3.0])
+        buf.append([10.0, None, 12.0, 11.0])
+        hosts, sweep = buf.summarize()
+        self.assertStats(hosts[0], {"rtt_min": 1.0, "rtt_avg": 2.5, "rtt_max": 4.0,
+                                    "rtt_p95": 3.85, "jitter": 4.0 / 3})
+        # Jitter only spans consecutive replies.
+        self.assertStats(hosts[1], {"rtt_min": 10.0, "rtt_avg": 11.0, "rtt_max": 12.0,
+                                    "rtt_p95": 11.9, "jitter": 1.0})
+        self.assertStats(sweep, {"rtt_min": 1.0, "rtt_avg": 43.0 / 7, "rtt_max": 12.0,
+                                 "rtt_p95": 12.0 - 0.3 * 1.0, "jitter": 5.0 / 4})
+
+    def test_all_lost_row(self):
+        buf = RttBuffer(3)
+        buf.append([None, None, None])
+        buf.append([5.0, 5.0, 5.0])
+        hosts, sweep = buf.summarize()
+        self.assertStats(hosts[0], NONE)
+        self.assertStats(hosts[1], {"rtt_min": 5.0, "rtt_avg": 5.0, "rtt_max": 5.0,
+                                    "rtt_p95": 5.0, "jitter": 0.0})
+        self.assertStats(sweep, hosts[1])
+
+    def test_all_lost_sweep(self):
+        buf = RttBuffer(2)
+        buf.append([])
+        buf.append([None])
+        hosts, sweep = buf.summarize()
+        self.assertEqual(len(hosts), 2)
+        for host in hosts:
+            self.assertStats(host, NONE)
+        self.assertStats(sweep, NONE)
+
+    def test_count_one(self):
+        buf = RttBuffer(1)
+        buf.append([7.0])
+        buf.append([None])
+        buf.append([3.0])
+        hosts, sweep = buf.summarize()
+        self.assertStats(hosts[0], {"rtt_min": 7.0, "rtt_avg": 7.0, "rtt_max": 7.0,
+                                    "rtt_p95": 7.0, "jitter": None})
+        self.assertStats(hosts[1], NONE)
+        self.assertStats(sweep, {"rtt_min": 3.0, "rtt_avg": 5.0, "rtt_max": 7.0,
+                                 "rtt_p95": 6.8, "jitter": None})
+
+    def test_append_pads_and_truncates(self):
+        buf = RttBuffer(2)
+        self.assertEqual(buf.append([1.0, 2.0, 3.0]), 0)
+        self.assertEqual(buf.append([4.0]), 1)
+        hosts, _ = buf.summarize()
+        self.assertEqual(hosts[0]["rtt_max"], 2.0)
+        self.assertEqual(hosts[1]["rtt_max"], 4.0)
+        self.assertIsNone(hosts[1]["jitter"])
+
+
+@unittest.skipIf(rtt.numpy is None, "numpy not installed")
+class SummarizeNumpyTest(SummarizePythonTest):
+    use_numpy = True
+
+
+class ExceededTest(unittest.TestCase):
+    def test_exceeded(self):
+        stats = {"rtt_avg": 20.0, "rtt_p95": 80.0, "jitter": None, "loss_rate": 0.5}
+        self.assertEqual(exceeded({"rtt_avg": 50, "rtt_p95": 50, "jitter": 1, "loss_rate": 0.2},
+                                  stats), ["loss_rate", "rtt_p95"])
+
+
+if __name__ == "__main__":
+    unittest.main()
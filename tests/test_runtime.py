@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.process import Subprocess
+
+from core.runtime import Runtime, SerialExecutor
+
+
+class RuntimeTest(unittest.TestCase):
+    def setUp(self):
+        self.ioloop = IOLoop()
+        self.ioloop.make_current()
+        self.runtime = Runtime(2, stop_timeout=1)
+        self.events = []
+
+    def tearDown(self):
+        self.runtime.shutdown()
+        Subprocess.uninitialize()
+        IOLoop.clear_current()
+        self.ioloop.close(all_fds=True)
+
+    @gen.coroutine
+    def _sweep(self, seconds):
+        self.events.append("sweep started")
+        yield gen.sleep(seconds)
+        self.events.append("sweep done")
+
+    def _run(self, stop_after):
+        self.ioloop.call_later(stop_after, self.runtime.stop)
+        start = time.time()
+        self.runtime.start()
+        return time.time() - start
+
+    def test_stop_waits_for_running_job(self):
+        self.runtime.add_interval("sweep", 60, self._sweep, (0.3,), delay=lambda: 0)
+        self.runtime.add_stop_callback(lambda: self.events.append("stop callback"))
+        self._run(0.1)
+        self.assertEqual(self.events, ["sweep started", "stop callback", "sweep done"])
+
+    def test_stop_gives_up_after_timeout(self):
+        self.runtime.stop_timeout = 0.2
+        self.runtime.add_interval("sweep", 60, self._sweep, (5,), delay=lambda: 0)
+        elapsed = self._run(0.1)
+        self.assertEqual(self.events, ["sweep started"])
+        self.assertLess(elapsed, 2)
+
+    def test_blocking_job_and_skip(self):
+        calls = []
+
+        def work():
+            calls.append(time.time())
+            time.sleep(0.25)
+
+        self.runtime.add_interval("replay", 0.05, work, blocking=True)
+        self._run(0.3)
+        # Later ticks are skipped while the first run is going.
+        self.assertEqual(len(calls), 1)
+
+    def test_blocking_jobs_do_not_queue_behind_executor(self):
+        calls = []
+        release = threading.Event()
+        for _ in range(self.runtime.max_workers):
+            self.runtime.run_in_executor(release.wait, 5)
+        self.runtime.add_interval("heartbeat", 0.05, lambda: calls.append(1), blocking=True)
+        self._run(0.2)
+        release.set()
+        self.assertGreaterEqual(len(calls), 2)
+
+    def test_aligned_job_rearms(self):
+        self.runtime.add_interval("sweep", 60, self._sweep, (0,), delay=lambda: 0.05)
+        self._run(0.28)
+        self.assertGreaterEqual(self.events.count("sweep done"), 3)
+
+
+class SerialExecutorTest(unittest.TestCase):
+    def test_runs_in_submission_order(self):
+        executor = SerialExecutor("test")
+        order = []
+        for i in range(50):
+            executor.submit(order.append, i)
+        executor.shutdown(wait=True)
+        self.assertEqual(order, range(50))
+
+    def test_max_pending(self):
+        executor = SerialExecutor("test", max_pending=2)
+        release = threading.Event()
+        self.assertIsNotNone(executor.submit(release.wait, 5))
+        self.assertIsNotNone(executor.submit(lambda: None))
+        self.assertIsNone(executor.submit(lambda: None))
+        release.set()
+        executor.shutdown(wait=True)
+        self.assertEqual(executor.stats(), {"pending": 0, "dropped": 1, "max_pending": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from peewee import SqliteDatabase
+
+from core import schema
+from core.models import Device
+
+RTT = {"rtt_min": 1.0, "rtt_avg": 2.0, "rtt_max": 3.0, "rtt_p95": 2.9, "jitter": 0.5}
+
+
+class RttColumnsTest(unittest.TestCase):
+    def setUp(self):
+        self.db = SqliteDatabase(":memory:")
+        self._bind = self.db.bind_ctx([Device])
+        self._bind.__enter__()
+
+    def tearDown(self):
+        self._bind.__exit__(None, None, None)
+        schema._missing = None
+
+    def test_all_columns(self):
+        Device.create_table()
+        self.assertEqual(schema.rtt_fields(self.db, RTT),
+                         {"rtt_min": 1.0, "rtt_max": 3.0, "rtt_p95": 2.9, "jitter": 0.5})
+
+    def test_missing_columns_are_skipped(self):
+        self.db.execute_sql("CREATE TABLE device (id INTEGER PRIMARY KEY, name TEXT, "
+                            "device_type INTEGER, mac TEXT, ipaddress TEXT, state INTEGER, "
+                            "enable INTEGER, avg REAL, loss_rate REAL, last_time TEXT)")
+        self.assertFalse(schema.check_rtt_columns(self.db))
+        self.assertEqual(schema.rtt_fields(self.db, RTT), {})
+
+    def test_no_summary(self):
+        self.assertEqual(schema.rtt_fields(self.db, None), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from peewee import OperationalError, SqliteDatabase
+from playhouse.pool import PooledSqliteDatabase
+from tornado.ioloop import IOLoop
+
+from core import services
+from core.models import Device
+from core.runtime import SerialExecutor
+from core.services import SyslogService, TrapService
+from core.spool import Spool, syslog_record
+
+CONNECT = "STA(MAC %s)成功连接"
+DISCONNECT = "STA(MAC %s)断开连接"
+
+
+class SyslogBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = PooledSqliteDatabase(os.path.join(self.tmp, "test.db"), max_connections=1,
+                                       timeout=2, check_same_thread=False)
+        self._bind = self.db.bind_ctx([Device])
+        self._bind.__enter__()
+        Device.create_table()
+        for i in range(8):
+            Device.create(name="ap%d" % i, device_type=1, mac="mac%d" % i, host="10.0.0.%d" % i,
+                          state=0, avg=0, loss_rate=0, last_time=datetime.datetime.now())
+        self.db.close()
+        self.executor = ThreadPoolExecutor(4)
+        self.writer = SerialExecutor("syslog", max_pending=100)
+        self.service = SyslogService(self.db, "127.0.0.1", 0, self.writer)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+        self.db.close_all()
+        self._bind.__exit__(None, None, None)
+        shutil.rmtree(self.tmp)
+
+    def _process(self, *batches):
+        # Straight to process_batch from several threads, as if unordered.
+        for batch in batches:
+            self.executor.submit(self.service.process_batch, batch)
+        self.executor.shutdown(wait=True)
+
+    def _state(self, mac):
+        return Device.get(Device.mac == mac).state
+
+    def test_batches_commit_in_arrival_order(self):
+        for i in range(40):
+            self.service._process_lines([(DISCONNECT if i % 2 else CONNECT) % "mac3"])
+        self.service._process_lines([DISCONNECT % "mac3"])
+        self.writer.shutdown(wait=True)
+        self.assertEqual(self.service.stats(), {"received": 41, "updated": 41})
+        self.assertEqual(self._state("mac3"), 0)
+
+    def test_queue_limit_drops_and_counts(self):
+        writer = SerialExecutor("syslog", max_pending=1)
+        service = SyslogService(self.db, "127.0.0.1", 0, writer)
+        release = threading.Event()
+        writer.submit(release.wait, 5)
+        service._process_lines([CONNECT % "mac1", CONNECT % "mac2"])
+        release.set()
+        writer.shutdown(wait=True)
+        self.assertEqual(service.stats(), {"received": 2, "dropped": 2})
+        self.assertEqual(writer.stats(), {"pending": 0, "dropped": 1, "max_pending": 1})
+        self.assertEqual(self._state("mac1"), 0)
+
+    def test_more_workers_than_connections(self):
+        self._process(*[[CONNECT % ("mac%d" % i)] for i in range(8)])
+        self.assertEqual(self.service.stats(), {"updated": 8})
+        self.assertEqual(len(self.db._in_use), 0)
+        self.assertEqual(Device.select().where(Device.state == 1).count(), 8)
+
+    def test_parse_failures_are_counted(self):
+        self._process([CONNECT % "mac0", "garbage"])
+        self.assertEqual(self.service.stats(), {"updated": 1, "parse_failed": 1})
+
+    def test_retries_once_on_operational_error(self):
+        calls = []
+        update = services.update_device_state
+
+        def flaky(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OperationalError("server has gone away")
+            update(*args)
+
+        services.update_device_state = flaky
+        try:
+            self._process([CONNECT % "mac1"])
+        finally:
+            services.update_device_state = update
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.service.stats(), {"updated": 1})
+
+    def test_second_failure_is_counted(self):
+        update = services.update_device_state
+
+        def broken(*args):
+            raise OperationalError("server has gone away")
+
+        services.update_device_state = broken
+        try:
+            self._process([CONNECT % "mac1", CONNECT % "mac2"])
+        finally:
+            services.update_device_state = update
+        self.assertEqual(self.service.stats(), {"db_failed": 2})
+        self.assertEqual(len(self.db._in_use), 0)
+
+
+class SlowDatabaseTest(unittest.TestCase):
+    """A write stalled on a lock stands in for a MySQL statement that runs
+    into query_timeout: both raise OperationalError after the timeout."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        path = os.path.join(self.tmp, "test.db")
+        self.db = SqliteDatabase(path, timeout=0.1, check_same_thread=False)
+        self._bind = self.db.bind_ctx([Device])
+        self._bind.__enter__()
+        Device.create_table()
+        Device.create(name="ap", device_type=1, mac="mac0", host="10.0.0.1",
+                      state=0, avg=0, loss_rate=0, last_time=datetime.datetime.now())
+        self.db.close()
+        self.blocker = SqliteDatabase(path, check_same_thread=False)
+        self.spool = Spool(os.path.join(self.tmp, "test.spool"), 4096)
+        self.service = SyslogService(self.db, "127.0.0.1", 0, InlineWriter(), self.spool)
+
+    def tearDown(self):
+        self.spool.close()
+        self.blocker.close()
+        self._bind.__exit__(None, None, None)
+        shutil.rmtree(self.tmp)
+
+    def test_slow_write_is_spooled(self):
+        self.blocker.execute_sql("BEGIN EXCLUSIVE")
+        start = time.time()
+        self.service.process_batch([CONNECT % "mac0"])
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(self.service.stats(), {"db_failed": 1, "spooled": 1})
+        self.assertEqual(self.spool.snapshot()[0], [syslog_record("mac0", None, 1)])
+
+        # The next batch queues behind it even though the database is back.
+        self.blocker.execute_sql("ROLLBACK")
+        self.service.process_batch([CONNECT % "mac0"])
+        self.assertEqual(self.service.stats(), {"db_failed": 1, "spooled": 2})
+        self.assertEqual(Device.get(Device.mac == "mac0").state, 0)
+
+
+class InlineWriter(object):
+    def submit(self, func, *args):
+        func(*args)
+        return True
+
+
+class RecordingSyslogService(SyslogService):
+    IDLE_FLUSH = 0.1
+
+    def __init__(self):
+        SyslogService.__init__(self, None, "127.0.0.1", 0, InlineWriter())
+        self.batches = []
+
+    def process_batch(self, msgs, received=None):
+        self.batches.append(msgs)
+
+
+class SyslogFramingTest(unittest.TestCase):
+    def setUp(self):
+        self.ioloop = IOLoop()
+        self.ioloop.make_current()
+        self.service = RecordingSyslogService()
+        self.server, self.client = socket.socketpair()
+        self.server.setblocking(0)
+        fd = self.server.fileno()
+        self.service.fd_map[fd] = self.server
+        self.ioloop.add_handler(fd, partial(self.service.handle_client, "peer"), IOLoop.READ)
+
+    def tearDown(self):
+        self.client.close()
+        IOLoop.clear_current()
+        self.ioloop.close(all_fds=True)
+
+    def _run(self, seconds=0.02):
+        self.ioloop.call_later(seconds, self.ioloop.stop)
+        self.ioloop.start()
+
+    def test_waits_for_newline(self):
+        self.client.sendall("first ")
+        self._run()
+        self.client.sendall("half\nsecond\nthi")
+        self._run()
+        self.client.sendall("rd\n")
+        self._run()
+        self.assertEqual(self.service.batches, [["first half", "second"], ["third"]])
+
+    def test_idle_partial_line_is_flushed(self):
+        self.client.sendall("no newline")
+        self._run()
+        self.assertEqual(self.service.batches, [])
+        self._run(0.2)
+        self.assertEqual(self.service.batches, [["no newline"]])
+
+    def test_new_data_postpones_flush(self):
+        self.client.sendall("slow")
+        self._run(0.07)
+        self.client.sendall(" sender")
+        self._run(0.07)
+        self.assertEqual(self.service.batches, [])
+        self._run(0.1)
+        self.assertEqual(self.service.batches, [["slow sender"]])
+
+    def test_close_flushes(self):
+        self.client.sendall("one\ntwo")
+        self.client.close()
+        self._run()
+        self.assertEqual(self.service.batches, [["one"], ["two"]])
+        self.assertEqual(self.service.fd_map, {})
+        self.assertEqual(self.service.flush_timeouts, {})
+
+    def test_stop_flushes(self):
+        self.client.sendall("pending")
+        self._run()
+        self.service.stop()
+        self.assertEqual(self.service.batches, [["pending"]])
+        self._run(0.2)
+        self.assertEqual(self.service.batches, [["pending"]])
+
+
+class BlockingTrapCallback(object):
+    def __init__(self):
+        self.release = threading.Event()
+        self.handled = 0
+
+    def accept(self, host, data):
+        return True
+
+    def __call__(self, dispatcher, domain, addr, data):
+        self.release.wait(5)
+        self.handled += 1
+
+
+class TrapServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(1)
+        self.trap_cb = BlockingTrapCallback()
+        self.service = TrapService(self.trap_cb, 0, self.executor, max_inflight=2)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        self.sock.bind(("127.0.0.1", 0))
+        self.service.fd_map[self.sock.fileno()] = self.sock
+
+    def tearDown(self):
+        self.trap_cb.release.set()
+        self.executor.shutdown(wait=True)
+        self.sock.close()
+
+    def test_excess_is_dropped_and_counted(self):
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in range(5):
+            sender.sendto("trap%d" % i, self.sock.getsockname())
+        sender.close()
+        self.service.handle_datagram(self.sock.fileno(), 0)
+        self.assertEqual(self.service.stats(), {"queued": 2, "dropped": 3, "inflight": 2})
+
+        self.trap_cb.release.set()
+        self.executor.shutdown(wait=True)
+        self.assertEqual(self.trap_cb.handled, 2)
+        self.assertEqual(self.service.stats(),
+                         {"queued": 2, "dropped": 3, "handled": 2, "inflight": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
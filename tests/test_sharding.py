@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from peewee import SqliteDatabase
+
+from core.models import Member
+from core.sharding import HashRing, ShardCoordinator, cycle_start, is_member
+
+KEYS = range(5000)
+DEVICES = range(500)
+# A cycle boundary.
+EPOCH = datetime.datetime(2026, 10, 19, 10, 0, 0)
+
+
+def _owners(ring):
+    return dict((key, ring.get(key)) for key in KEYS)
+
+
+class HashRingTest(unittest.TestCase):
+    def test_empty(self):
+        self.assertIsNone(HashRing().get(1))
+
+    def test_every_node_gets_a_share(self):
+        ring = HashRing(["a", "b", "c"])
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(set(_owners(ring).values()), set(["a", "b", "c"]))
+
+    def test_join_moves_only_to_new_node(self):
+        ring = HashRing(["a", "b", "c"])
+        before = _owners(ring)
+        ring.add("d")
+        after = _owners(ring)
+        moved = [key for key in KEYS if before[key] != after[key]]
+        self.assertTrue(moved)
+        self.assertTrue(all(after[key] == "d" for key in moved))
+        # Roughly a quarter of the keys, not a reshuffle.
+        self.assertLess(len(moved), len(KEYS) / 2)
+
+    def test_leave_moves_only_departed_share(self):
+        ring = HashRing(["a", "b", "c", "d"])
+        before = _owners(ring)
+        ring.remove("d")
+        after = _owners(ring)
+        for key in KEYS:
+            if before[key] == "d":
+                self.assertNotEqual(after[key], "d")
+            else:
+                self.assertEqual(after[key], before[key])
+
+    def test_join_then_leave_restores_owners(self):
+        ring = HashRing(["a", "b", "c"])
+        before = _owners(ring)
+        ring.add("d")
+        ring.remove("d")
+        self.assertEqual(_owners(ring), before)
+
+    def test_same_members_same_ring(self):
+        self.assertEqual(_owners(HashRing(["a", "b", "c"])), _owners(HashRing(["c", "a", "b"])))
+
+
+def _at(seconds):
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class MembershipTest(unittest.TestCase):
+    def _member(self, joined, lease, left=None):
+        return Member(node_id="a", joined_time=_at(joined), heartbeat_time=_at(joined),
+                      lease_expires=_at(lease), left_time=left if left is None else _at(left))
+
+    def test_cycle_start(self):
+        self.assertEqual(cycle_start(_at(0), 60), _at(0))
+        self.assertEqual(cycle_start(_at(59.5), 60), _at(0))
+        self.assertEqual(cycle_start(_at(61), 60), _at(60))
+
+    def test_joined_before_cycle(self):
+        self.assertTrue(is_member(self._member(-5, 25), _at(0)))
+
+    def test_joined_mid_cycle_waits(self):
+        member = self._member(30, 60)
+        self.assertFalse(is_member(member, _at(0)))
+        self.assertTrue(is_member(member, _at(60)))
+
+    def test_left_mid_cycle_keeps_share(self):
+        member = self._member(-100, 50, left=25)
+        self.assertTrue(is_member(member, _at(0)))
+        self.assertFalse(is_member(member, _at(60)))
+
+    def test_lease_expired_at_cycle_start(self):
+        self.assertFalse(is_member(self._member(-100, -1), _at(0)))
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = _at(-5)
+
+    def advance(self, seconds):
+        self.now += datetime.timedelta(seconds=seconds)
+
+
+class FakeClockCoordinator(ShardCoordinator):
+    def __init__(self, clock, *args, **kwargs):
+        self.clock = clock
+        super(FakeClockCoordinator, self).__init__(*args, **kwargs)
+
+    def _db_now(self):
+        return self.clock.now
+
+
+class CoordinatorTest(unittest.TestCase):
+    """Nodes heartbeat every 10s and sweep at their own offset in the cycle."""
+
+    INTERVAL = 60
+    # Offset into each cycle at which a node sweeps.
+    SWEEP_AT = {"a": 2, "b": 20, "c": 40}
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = SqliteDatabase(os.path.join(self.tmp, "test.db"))
+        self._bind = self.db.bind_ctx([Member])
+        self._bind.__enter__()
+        self.clock = FakeClock()
+        self.nodes = dict((node_id, FakeClockCoordinator(self.clock, self.db, node_id,
+                                                         interval=self.INTERVAL, lease_time=30))
+                          for node_id in self.SWEEP_AT)
+        self.running = set()
+        # cycle -> node -> devices swept
+        self.swept = collections.defaultdict(dict)
+
+    def tearDown(self):
+        self.db.close()
+        self._bind.__exit__(None, None, None)
+        shutil.rmtree(self.tmp)
+
+    def _run(self, until, events):
+        """Step the clock a second at a time up to ``until`` seconds past EPOCH.
+
+        ``events`` maps a second to a list of (action, node) to apply then;
+        "start"/"stop" join and leave, "pause"/"resume" stop and restart
+        heartbeats and sweeps without leaving, as a hung or partitioned node.
+        """
+        while self.clock.now < _at(until):
+            second = int((self.clock.now - EPOCH).total_seconds())
+            for action, node_id in events.get(second, ()):
+                node = self.nodes[node_id]
+                if action == "start":
+                    node.start()
+                elif action == "stop":
+                    node.stop()
+                if action in ("start", "resume"):
+                    self.running.add(node_id)
+                else:
+                    self.running.discard(node_id)
+            for node_id in sorted(self.running):
+                node = self.nodes[node_id]
+                if second % 10 == 0:
+                    node.heartbeat()
+                if second % self.INTERVAL == self.SWEEP_AT[node_id]:
+                    ring = node.ring()
+                    self.swept[second // self.INTERVAL][node_id] = set(
+                        device for device in DEVICES if node.owns(device, ring))
+            self.clock.advance(1)
+
+    def _owners(self, cycle):
+        owners = collections.defaultdict(list)
+        for node_id, devices in self.swept[cycle].items():
+            for device in devices:
+                owners[device].append(node_id)
+        return owners
+
+    def assertSweptOnce(self, cycle, by):
+        owners = self._owners(cycle)
+        self.assertEqual(set(owners), set(DEVICES), "cycle %d missed devices" % cycle)
+        self.assertTrue(all(len(nodes) == 1 for nodes in owners.values()),
+                        "cycle %d swept devices twice" % cycle)
+        self.assertEqual(set(node_id for nodes in owners.values() for node_id in nodes), set(by))
+
+    def test_join_and_leave(self):
+        self._run(300, {
+            -5: [("start", "a"), ("start", "b")],
+            # Joins after a and b swept cycle 1, sweeps it with nothing to do.
+            90: [("start", "c")],
+            # Leaves after sweeping cycle 2; c must not pick up its share.
+            145: [("stop", "b")],
+        })
+        self.assertSweptOnce(0, "ab")
+        self.assertSweptOnce(1, "ab")
+        self.assertEqual(self.swept[1]["c"], set())
+        self.assertSweptOnce(2, "abc")
+        self.assertSweptOnce(3, "ac")
+        self.assertSweptOnce(4, "ac")
+
+    def test_expired_lease_rejoins_next_cycle(self):
+        self._run(360, {
+            -5: [("start", "a"), ("start", "b")],
+            # Hangs right after sweeping cycle 2; its lease runs out at 170,
+            # before cycle 3 starts.
+            145: [("pause", "b")],
+            # Back in cycle 3 with the same node id and a valid lease before
+            # its sweep at 200, after a swept everything at 182.
+            185: [("resume", "b")],
+        })
+        self.assertSweptOnce(2, "ab")
+        self.assertSweptOnce(3, "a")
+        self.assertEqual(self.swept[3]["b"], set())
+        self.assertSweptOnce(4, "ab")
+        self.assertSweptOnce(5, "ab")
+
+    def test_stale_rows_removed(self):
+        self._run(200, {
+            -5: [("start", "a"), ("start", "b")],
+            30: [("stop", "b")],
+        })
+        self.assertEqual([m.node_id for m in Member.select()], ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from core.spool import HEADER_SIZE, Spool, syslog_record
+
+
+def _record(i):
+    return syslog_record("mac%d" % i, "10.0.0.%d" % (i % 256), i % 2)
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "test.spool")
+        self.spools = []
+
+    def tearDown(self):
+        for spool in self.spools:
+            try:
+                spool.close()
+            except ValueError:
+                pass
+        shutil.rmtree(self.tmp)
+
+    def _open(self, max_size=4096):
+        spool = Spool(self.path, max_size)
+        self.spools.append(spool)
+        return spool
+
+    def test_empty(self):
+        spool = self._open()
+        self.assertFalse(spool.pending())
+        self.assertEqual(spool.snapshot()[0], [])
+
+    def test_reopen_after_crash_keeps_pending(self):
+        spool = self._open()
+        spool.extend([_record(i) for i in range(5)])
+        # No close(): the second instance sees what fsync=always flushed.
+        reopened = self._open()
+        self.assertEqual(reopened.snapshot()[0], [_record(i) for i in range(5)])
+
+    def test_reopen_after_partial_consume(self):
+        spool = self._open()
+        spool.extend([_record(i) for i in range(3)])
+        records, offset = spool.snapshot()
+        spool.extend([_record(i) for i in range(3, 6)])
+        spool.consume(offset)
+        self.assertEqual(spool.snapshot()[0], [_record(i) for i in range(3, 6)])
+        spool.close()
+        self.assertEqual(self._open().snapshot()[0], [_record(i) for i in range(3, 6)])
+
+    def test_consume_all_resets(self):
+        spool = self._open()
+        spool.extend([_record(i) for i in range(3)])
+        spool.consume(spool.snapshot()[1])
+        self.assertFalse(spool.pending())
+        self.assertEqual(spool._tail, HEADER_SIZE)
+        spool.close()
+        self.assertFalse(self._open().pending())
+
+    def test_torn_record_is_ignored(self):
+        spool = self._open()
+        spool.extend([_record(0), _record(1)])
+        tail = spool._tail
+        # A crash after the payload but before its header was written.
+        spool._mm[tail:tail + 8] = "\x10\0\0\0\0\0\0\0"
+        spool._mm.flush()
+        self.assertEqual(self._open().snapshot()[0], [_record(0), _record(1)])
+
+    def test_compacts_under_steady_traffic(self):
+        spool = self._open(max_size=4096)
+        written = 0
+        replayed = []
+        # Each round appends more than the replay consumed the round before,
+        # which used to fill the spool as the tail never went back.
+        for _ in range(200):
+            spool.extend([_record(written), _record(written + 1)])
+            written += 2
+            records, offset = spool.snapshot()
+            spool.extend([_record(written)])
+            written += 1
+            spool.consume(offset)
+            replayed.extend(records)
+        replayed.extend(spool.snapshot()[0])
+        self.assertEqual(spool.dropped, 0)
+        self.assertEqual(replayed, [_record(i) for i in range(written)])
+        self.assertLess(spool._tail, 4096 / 2)
+
+    def test_compaction_survives_reopen(self):
+        spool = self._open()
+        spool.extend([_record(i) for i in range(10)])
+        records, offset = spool.snapshot()
+        spool.extend([_record(10)])
+        spool.consume(offset)
+        self.assertEqual(spool._head, HEADER_SIZE)
+        self.assertEqual(self._open().snapshot()[0], [_record(10)])
+
+    def test_full_drops_and_counts(self):
+        spool = self._open(max_size=256)
+        spool.extend([_record(i) for i in range(20)])
+        self.assertGreater(spool.dropped, 0)
+        kept = len(spool.snapshot()[0])
+        self.assertEqual(kept + spool.dropped, 20)
+
+    def test_reopen_smaller_keeps_pending(self):
+        spool = self._open(max_size=8192)
+        spool.extend([_record(i) for i in range(100)])
+        self.assertGreater(spool._tail, 4096)
+        spool.close()
+        reopened = self._open(max_size=4096)
+        self.assertEqual(reopened.max_size, 8192)
+        self.assertEqual(reopened.snapshot()[0], [_record(i) for i in range(100)])
+
+    def test_reopen_smaller_shrinks_when_empty(self):
+        spool = self._open(max_size=8192)
+        spool.extend([_record(i) for i in range(100)])
+        spool.consume(spool.snapshot()[1])
+        spool.close()
+        reopened = self._open(max_size=4096)
+        self.assertEqual(reopened.max_size, 4096)
+        self.assertEqual(os.path.getsize(self.path), 4096)
+        self.assertFalse(reopened.pending())
+
+
+class WriteThroughTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.spool = Spool(os.path.join(self.tmp, "test.spool"), 4096)
+        self.written = []
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name):
+        return lambda: self.written.append(name)
+
+    def _fail(self):
+        raise IOError("database down")
+
+    def test_writes_when_nothing_pending(self):
+        self.assertTrue(self.spool.write_through(self._write("a"), [_record(0)]))
+        self.assertEqual(self.written, ["a"])
+        self.assertFalse(self.spool.pending())
+
+    def test_failure_is_spooled_and_raised(self):
+        self.assertRaises(IOError, self.spool.write_through, self._fail, [_record(0)])
+        self.assertEqual(self.spool.snapshot()[0], [_record(0)])
+
+    def test_queues_behind_pending(self):
+        self.spool.append(_record(0))
+        self.assertFalse(self.spool.write_through(self._write("a"), [_record(1)]))
+        self.assertEqual(self.written, [])
+        self.assertEqual(self.spool.snapshot()[0], [_record(0), _record(1)])
+
+    def test_newer_write_waits_for_failing_one(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_failure():
+            started.set()
+            release.wait(5)
+            raise IOError("write timed out")
+
+        def older():
+            try:
+                self.spool.write_through(slow_failure, [_record(0)])
+            except IOError:
+                pass
+
+        first = threading.Thread(target=older)
+        first.start()
+        started.wait(5)
+        # The database is back for the newer batch, but the older one has
+        # not reached the spool yet.
+        second = threading.Thread(target=self.spool.write_through,
+                                  args=(self._write("newer"), [_record(1)]))
+        second.start()
+        second.join(0.1)
+        self.assertTrue(second.is_alive())
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(self.written, [])
+        self.assertEqual(self.spool.snapshot()[0], [_record(0), _record(1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
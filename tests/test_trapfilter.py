@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from core.exceptions import ConfigError
+from core.trapfilter import TrapFilter, peek
+
+
+def _tlv(tag, value, long_form=0):
+    length = len(value)
+    if long_form:
+        encoded = []
+        for _ in range(long_form):
+            encoded.insert(0, length & 0xff)
+            length >>= 8
+        header = chr(tag) + chr(0x80 | long_form) + "".join(chr(b) for b in encoded)
+    else:
+        header = chr(tag) + chr(length)
+    return header + value
+
+
+def _message(version=1, community="public", pdu_tag=0xa7, long_form=0, pdu="\x02\x01\x00"):
+    body = (_tlv(0x02, chr(version)) + _tlv(0x04, community, long_form) +
+            _tlv(pdu_tag, pdu, long_form))
+    return _tlv(0x30, body, long_form)
+
+
+class PeekTest(unittest.TestCase):
+    def test_short_form(self):
+        self.assertEqual(peek(_message()), (1, "public", 0xa7))
+        self.assertEqual(peek(_message(0, pdu_tag=0xa4)), (0, "public", 0xa4))
+
+    def test_long_form_lengths(self):
+        for count in (1, 2, 4):
+            self.assertEqual(peek(_message(long_form=count)), (1, "public", 0xa7))
+
+    def test_long_form_community_over_127_bytes(self):
+        community = "c" * 300
+        self.assertEqual(peek(_message(community=community, long_form=2)),
+                         (1, community, 0xa7))
+
+    def test_long_form_too_many_length_bytes(self):
+        data = "\x30\x85\x00\x00\x00\x00\x05" + _tlv(0x02, "\x01")
+        self.assertIsNone(peek(data))
+
+    def test_indefinite_length(self):
+        self.assertIsNone(peek("\x30\x80" + _tlv(0x02, "\x01")))
+
+    def test_truncated(self):
+        data = _message(long_form=2)
+        # Every prefix that stops before the PDU tag is rejected, never raised.
+        pdu_offset = len(data) - len(_tlv(0xa7, "\x02\x01\x00", 2))
+        for end in range(pdu_offset + 1):
+            self.assertIsNone(peek(data[:end]), end)
+
+    def test_length_past_end(self):
+        self.assertIsNone(peek("\x30\x82\xff\xff" + _tlv(0x02, "\x01")))
+
+    def test_wrong_tags(self):
+        self.assertIsNone(peek(_tlv(0x31, _tlv(0x02, "\x01") + _tlv(0x04, "public") + "\xa7")))
+        self.assertIsNone(peek(_tlv(0x30, _tlv(0x04, "\x01") + _tlv(0x04, "public") + "\xa7")))
+        self.assertIsNone(peek(_tlv(0x30, _tlv(0x02, "\x01") + _tlv(0x02, "public") + "\xa7")))
+
+    def test_oversized_version(self):
+        self.assertIsNone(peek(_tlv(0x30, _tlv(0x02, "\x01" * 5) + _tlv(0x04, "public") + "\xa7")))
+        self.assertIsNone(peek(_tlv(0x30, _tlv(0x02, "") + _tlv(0x04, "public") + "\xa7")))
+
+    def test_garbage(self):
+        self.assertIsNone(peek(""))
+        self.assertIsNone(peek("\x30"))
+        self.assertIsNone(peek("not a trap"))
+
+
+class TrapFilterTest(unittest.TestCase):
+    def test_reasons(self):
+        trap_filter = TrapFilter("public", allow=["10.0.0.0/8"], deny=["10.1.0.0/16"])
+        self.assertIsNone(trap_filter.check("10.2.3.4", _message()))
+        self.assertEqual(trap_filter.check("10.2.3.4", "junk"), "malformed")
+        self.assertEqual(trap_filter.check("10.2.3.4", _message(pdu_tag=0xa0)), "not_trap")
+        self.assertEqual(trap_filter.check("10.2.3.4", _message(community="x")), "community")
+        self.assertEqual(trap_filter.check("10.1.3.4", _message()), "source")
+        self.assertEqual(trap_filter.check("192.168.0.1", _message()), "source")
+        self.assertEqual(trap_filter.stats(), {"accepted": 1, "malformed": 1, "not_trap": 1,
+                                               "community": 1, "source": 2})
+
+    def test_invalid_network(self):
+        self.assertRaises(ConfigError, TrapFilter, allow=["10.0.0.0/33"])
+        self.assertRaises(ConfigError, TrapFilter, deny=["nonsense"])
+
+
+if __name__ == "__main__":
+    unittest.main()
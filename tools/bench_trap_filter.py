@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks TrapFilter against a full BER decode of the same datagrams.
+
+    python -m tools.bench_trap_filter -n 20000
+"""
+
+import argparse
+import time
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+from pysnmp.proto.api import v1, v2c
+
+from core.trapfilter import TrapFilter
+
+
+def build_trap(proto_module, community):
+    pdu = proto_module.TrapPDU()
+    proto_module.apiTrapPDU.setDefaults(pdu)
+    msg = proto_module.Message()
+    proto_module.apiMessage.setDefaults(msg)
+    proto_module.apiMessage.setCommunity(msg, community)
+    proto_module.apiMessage.setPDU(msg, pdu)
+    return encoder.encode(msg)
+
+
+def full_decode(whole_msg):
+    proto_module = api.protoModules[int(api.decodeMessageVersion(whole_msg))]
+    req_msg, _ = decoder.decode(whole_msg, asn1Spec=proto_module.Message())
+    return proto_module.apiMessage.getCommunity(req_msg)
+
+
+def rate(func, packets, count):
+    start = time.time()
+    for i in xrange(count):
+        func(packets[i % len(packets)])
+    return count / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trap pre-filter benchmark.")
+    parser.add_argument("-n", "--count", type=int, default=20000,
+                        help="Packets per measurement.")
+    parser.add_argument("--community", default="public")
+    args = parser.parse_args()
+
+    trap_filter = TrapFilter(args.community, deny=["10.0.0.0/8"])
+    cases = [
+        ("v2c trap, accepted", "192.0.2.1", build_trap(v2c, args.community)),
+        ("v1 trap, accepted", "192.0.2.1", build_trap(v1, args.community)),
+        ("wrong community", "192.0.2.1", build_trap(v2c, "spoofed")),
+        ("denied source", "10.1.2.3", build_trap(v2c, args.community)),
+        ("garbage", "192.0.2.1", "\x30\x82\xff\xff" + "\x00" * 60),
+    ]
+
+    print "%-20s %12s %12s %8s" % ("case", "filter pps", "decode pps", "speedup")
+    for name, host, packet in cases:
+        reason = trap_filter.check(host, packet)
+        filter_pps = rate(lambda p: trap_filter.check(host, p), [packet], args.count)
+        try:
+            decode_pps = rate(full_decode, [packet], max(1, args.count // 10))
+        except Exception:
+            print "%-20s %12.0f %12s %8s  (%s)" % (name, filter_pps, "error", "-", reason)
+            continue
+        print "%-20s %12.0f %12.0f %7.1fx  (%s)" % (name, filter_pps, decode_pps,
+                                                  filter_pps / decode_pps,
+                                                  reason or "kept")
+
+
+if __name__ == "__main__":
+    main()
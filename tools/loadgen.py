@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Records and replays syslog and trap traffic against a healthchecker.
+
+    python -m tools.loadgen record -s http://127.0.0.1:8890 --seconds 300
+    python -m tools.loadgen info capture-20261019-101500.hccap
+    python -m tools.loadgen replay capture-20261019-101500.hccap \\
+        --speed 10 -s http://127.0.0.1:8890
+
+Recording runs inside the daemon (POST /capture), so the capture holds
+exactly what the live listeners received. Replay sends syslog payloads
+over TCP and traps over UDP, then diffs /stats to report what the daemon
+ingested.
+"""
+
+import argparse
+import json
+import socket
+import sys
+import time
+import urllib2
+
+from core.capture import KINDS, SYSLOG, TRAP, read_capture
+
+
+def _address(value):
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _lines(data):
+    return len([line for line in data.split("\n") if line.strip()])
+
+
+def get_stats(url):
+    return json.load(urllib2.urlopen(url.rstrip("/") + "/stats", timeout=10))
+
+
+def record(args):
+    request = urllib2.Request("%s/capture?seconds=%d" % (args.stats.rstrip("/"), args.seconds),
+                              data="")
+    response = json.load(urllib2.urlopen(request, timeout=10))
+    print "recording for %ds to %s on the daemon host" % (args.seconds, response["output"])
+
+
+def info(args):
+    counts = dict((kind, 0) for kind in KINDS)
+    sizes = dict((kind, 0) for kind in KINDS)
+    first = last = None
+    for timestamp, kind, data in read_capture(args.capture):
+        first = timestamp if first is None else first
+        last = timestamp
+        counts[kind] += 1
+        sizes[kind] += len(data)
+    duration = (last - first) if first is not None else 0
+    print "duration: %.1fs" % duration
+    for kind, name in sorted(KINDS.items()):
+        print "%-7s %8d records %10d bytes %8.1f/s" % (
+            name, counts[kind], sizes[kind], counts[kind] / duration if duration else 0)
+
+
+def replay(args):
+    syslog_addr = _address(args.syslog)
+    trap_addr = _address(args.trap)
+    syslog_sock = None
+    trap_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    before = get_stats(args.stats) if args.stats else None
+    sent = {"syslog": 0, "syslog_lines": 0, "trap": 0, "errors": 0}
+
+    start = time.time()
+    first = None
+    for timestamp, kind, data in read_capture(args.capture):
+        if first is None:
+            first = timestamp
+        if not args.max_rate:
+            delay = start + (timestamp - first) / args.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            if kind == SYSLOG:
+                if syslog_sock is None:
+                    syslog_sock = socket.create_connection(syslog_addr)
+                syslog_sock.sendall(data)
+                sent["syslog"] += 1
+                sent["syslog_lines"] += _lines(data)
+            elif kind == TRAP:
+                trap_sock.sendto(data, trap_addr)
+                sent["trap"] += 1
+        except socket.error as err:
+            sent["errors"] += 1
+            if kind == SYSLOG and syslog_sock is not None:
+                syslog_sock.close()
+                syslog_sock = None
+            print >> sys.stderr, "send %s failed: %s" % (KINDS[kind], err)
+    elapsed = time.time() - start
+
+    if syslog_sock is not None:
+        syslog_sock.close()
+
+    total = sent["syslog"] + sent["trap"]
+    print "sent %d syslog payloads (%d lines), %d traps in %.2fs: %.0f msg/s, %d send errors" % (
+        sent["syslog"], sent["syslog_lines"], sent["trap"], elapsed,
+        total / elapsed if elapsed else 0, sent["errors"])
+
+    if before is None:
+        return
+    time.sleep(args.settle)
+    report(before, get_stats(args.stats), sent, elapsed)
+
+
+def _delta(before, after, *keys):
+    for key in keys:
+        before = before.get(key, {})
+        after = after.get(key, {})
+    return dict((name, after.get(name, 0) - before.get(name, 0)) for name in after)
+
+
+def _latency(before, after, name):
+    b = before.get("timers", {}).get(name, {})
+    a = after.get("timers", {}).get(name, {})
+    count = a.get("count", 0) - b.get("count", 0)
+    if not count:
+        return "n/a"
+    mean = (a.get("total", 0) - b.get("total", 0)) / count
+    return "%d samples, mean %.1fms, max %.1fms (since start)" % (
+        count, mean * 1000, a.get("max", 0) * 1000)
+
+
+def report(before, after, sent, elapsed):
+    syslog = _delta(before, after, "syslog")
+    traps = _delta(before, after, "trap_filter")
+    trap_work = _delta(before, after, "traps")
+    received = syslog.get("received", 0)
+    arrived = sum(traps.values())
+
+    print "syslog:"
+    print "  received %d lines, %.0f/s" % (received, received / elapsed if elapsed else 0)
+    print "  parse failures %d, updated %d, spooled %d, db failures %d" % (
+        syslog.get("parse_failed", 0), syslog.get("updated", 0),
+        syslog.get("spooled", 0), syslog.get("db_failed", 0))
+    print "  dropped %d (sent lines - received), %d over the queue limit" % (
+        sent["syslog_lines"] - received, syslog.get("dropped", 0))
+    print "  db update latency: %s" % _latency(before, after, "syslog.e2e")
+    print "traps:"
+    print "  arrived %d, accepted %d, filtered %s" % (
+        arrived, traps.get("accepted", 0),
+        dict((k, v) for k, v in traps.items() if k != "accepted" and v))
+    print "  dropped %d (sent - arrived), %d over the in-flight limit" % (
+        sent["trap"] - arrived, trap_work.get("dropped", 0))
+    print "  queued %d, handled %d, in flight %d" % (
+        trap_work.get("queued", 0), trap_work.get("handled", 0),
+        after.get("traps", {}).get("inflight", 0))
+    print "  handling latency: %s" % _latency(before, after, "trap.e2e")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Syslog and trap load generator.")
+    subparsers = parser.add_subparsers()
+
+    sub = subparsers.add_parser("record", help="Capture live traffic inside the daemon.")
+    sub.add_argument("-s", "--stats", required=True, help="Stats URL, e.g. http://127.0.0.1:8890")
+    sub.add_argument("--seconds", type=int, default=60, help="Capture window.")
+    sub.set_defaults(func=record)
+
+    sub = subparsers.add_parser("info", help="Summarize a capture file.")
+    sub.add_argument("capture")
+    sub.set_defaults(func=info)
+
+    sub = subparsers.add_parser("replay", help="Replay a capture file.")
+    sub.add_argument("capture")
+    sub.add_argument("--syslog", default="127.0.0.1:8889", help="Syslog TCP host:port.")
+    sub.add_argument("--trap", default="127.0.0.1:162", help="Trap UDP host:port.")
+    sub.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier.")
+    sub.add_argument("--max-rate", action="store_true", help="Send as fast as possible.")
+    sub.add_argument("-s", "--stats", default=None, help="Stats URL to report ingestion from.")
+    sub.add_argument("--settle", type=float, default=5.0,
+                     help="Seconds to wait for the daemon before reading stats.")
+    sub.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()